@@ -1,21 +1,255 @@
+import asyncio
+import codecs
 import json
+import logging
+import random
+from pathlib import Path
+from typing import Any, AsyncIterator, Iterator
 
-from datetime import datetime
+import aiohttp
 from pprint import pprint
 from pydantic import ValidationError
 
-from app.models import Plan_
+from app.models import Order_, Plan_
 
+logger = logging.getLogger(__name__)
 
-class API:
+
+class OrderStreamParser:
     def __init__(self) -> None:
-        self._json_file = open("fixtures/response.example.json", "r")
+        self._json_decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._started = False
+        self._finished = False
+
+    def feed(self, chunk: bytes | str) -> Iterator[Order_]:
+        if isinstance(chunk, bytes):
+            chunk = self._text_decoder.decode(chunk)
+        self._buffer += chunk
+        yield from self._drain()
+
+    def close(self) -> Iterator[Order_]:
+        self._buffer += self._text_decoder.decode(b"", final=True)
+        yield from self._drain()
+        if not self._finished:
+            raise ValueError("Plan payload ended before the orders array was closed")
+
+    def _drain(self) -> Iterator[Order_]:
+        pos = 0
+        buffer = self._buffer
+        while not self._finished:
+            pos = self._skip_separators(buffer, pos)
+            if pos >= len(buffer):
+                break
+            if not self._started:
+                if buffer[pos] != "[":
+                    raise ValueError(f"Expected orders array, got {buffer[pos]!r}")
+                self._started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                self._finished = True
+                pos += 1
+                break
+            try:
+                raw, pos = self._json_decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The order is not complete yet, wait for the next chunk.
+                break
+            yield self._validate(raw)
+        self._buffer = buffer[pos:]
 
-    def get_plan(self) -> Plan_:
-        response = '{"orders": ' + self._json_file.read() + "}"
+    def _skip_separators(self, buffer: str, pos: int) -> int:
+        while pos < len(buffer):
+            char = buffer[pos]
+            if not (char.isspace() or (self._started and char == ",")):
+                break
+            pos += 1
+        return pos
+
+    @staticmethod
+    def _validate(raw: Any) -> Order_:
+        # A partial plan must not reach the database, the whole load fails.
+        try:
+            return Order_.model_validate(raw)
+        except ValidationError as e:
+            order_id = raw.get("id") if isinstance(raw, dict) else None
+            logger.error("Invalid order %s in plan: %s", order_id, e)
+            raise
+
+
+class PlanNotModified(Exception):
+    pass
+
+
+class API:
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, path: str | Path = "fixtures/response.example.json") -> None:
+        self._path = Path(path)
+
+    def get_plan(self) -> Plan_ | None:
+        with self._path.open("r", encoding="utf-8") as json_file:
+            response = '{"orders": ' + json_file.read() + "}"
         try:
             result = Plan_.model_validate_json(response)
         except ValidationError as e:
             pprint(json.loads(e.json()))
         else:
             return result
+
+    def iter_orders(self) -> Iterator[Order_]:
+        parser = OrderStreamParser()
+        with self._path.open("rb") as json_file:
+            while chunk := json_file.read(self.CHUNK_SIZE):
+                yield from parser.feed(chunk)
+        yield from parser.close()
+
+
+class PlanClient:
+    CHUNK_SIZE = 64 * 1024
+    RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+    def __init__(
+        self,
+        url: str,
+        headers: dict[str, str] | None = None,
+        timeout: float = 60.0,
+        connect_timeout: float = 5.0,
+        retries: int = 3,
+        backoff: float = 0.5,
+        pool_size: int = 10,
+        validators_path: Path | None = None,
+    ) -> None:
+        self.url = url
+        self.headers = headers or {}
+        self.retries = retries
+        self.backoff = backoff
+        self._timeout = aiohttp.ClientTimeout(
+            total=None, sock_connect=connect_timeout, sock_read=timeout
+        )
+        self._pool_size = pool_size
+        self._session: aiohttp.ClientSession | None = None
+        self._validators_path = validators_path
+        self._validators: dict[str, dict[str, str]] = self._load_validators()
+        # Validators of fully read plans, waiting for commit_validators().
+        self._pending: dict[str, dict[str, str]] = {}
+
+    async def __aenter__(self) -> "PlanClient":
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def get_plan(self, params: dict[str, str] | None = None) -> Plan_ | None:
+        """Validators are not committed, call commit_validators() once stored."""
+        try:
+            return Plan_(orders=[order async for order in self.iter_orders(params)])
+        except PlanNotModified:
+            return None
+
+    def commit_validators(self, params: dict[str, str] | None = None) -> None:
+        """
+        Stores the ETag/Last-Modified of the plan read last for `params`, so
+        later requests may get 304. Call it only after the plan was written:
+        a plan lost to a failed write must be downloaded again.
+        """
+        key = self._cache_key(params)
+        if (validators := self._pending.pop(key, None)) is None:
+            return
+        self._validators[key] = validators
+        if self._validators_path is not None:
+            self._validators_path.parent.mkdir(parents=True, exist_ok=True)
+            self._validators_path.write_text(json.dumps(self._validators, indent=2))
+
+    async def iter_orders(
+        self, params: dict[str, str] | None = None, conditional: bool = True
+    ) -> AsyncIterator[Order_]:
+        """
+        Pass conditional=False when the plan is not stored: its validators
+        would still turn into a 304 and the plan would never be loaded.
+        """
+        key = self._cache_key(params)
+        headers = self._conditional_headers(key) if conditional else {}
+        response = await self._request(params, headers)
+        async with response:
+            if response.status == 304:
+                logger.info("Plan %s not modified", key)
+                raise PlanNotModified(key)
+            response.raise_for_status()
+            parser = OrderStreamParser()
+            async for chunk in response.content.iter_chunked(self.CHUNK_SIZE):
+                for order in parser.feed(chunk):
+                    yield order
+            for order in parser.close():
+                yield order
+            # Kept aside until the caller has written the plan.
+            self._remember(key, response)
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=self._timeout, headers=self.headers
+            )
+        return self._session
+
+    async def _request(
+        self, params: dict[str, str] | None, headers: dict[str, str]
+    ) -> aiohttp.ClientResponse:
+        session = await self._get_session()
+        for attempt in range(self.retries + 1):
+            try:
+                response = await session.get(self.url, params=params, headers=headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning("Plan request failed (%s), attempt %s", e, attempt + 1)
+            else:
+                if response.status not in self.RETRY_STATUSES or attempt == self.retries:
+                    return response
+                logger.warning(
+                    "Plan request got %s, attempt %s", response.status, attempt + 1
+                )
+                response.release()
+            delay = self.backoff * 2**attempt
+            await asyncio.sleep(delay + random.uniform(0, delay))
+        raise RuntimeError("unreachable")
+
+    def _cache_key(self, params: dict[str, str] | None) -> str:
+        if not params:
+            return self.url
+        return self.url + "?" + "&".join(f"{k}={v}" for k, v in sorted(params.items()))
+
+    def _conditional_headers(self, key: str) -> dict[str, str]:
+        validators = self._validators.get(key, {})
+        headers = {}
+        if etag := validators.get("etag"):
+            headers["If-None-Match"] = etag
+        if last_modified := validators.get("last_modified"):
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def _remember(self, key: str, response: aiohttp.ClientResponse) -> None:
+        validators = {}
+        if etag := response.headers.get("ETag"):
+            validators["etag"] = etag
+        if last_modified := response.headers.get("Last-Modified"):
+            validators["last_modified"] = last_modified
+        if validators:
+            self._pending[key] = validators
+
+    def _load_validators(self) -> dict[str, dict[str, str]]:
+        if self._validators_path is None or not self._validators_path.exists():
+            return {}
+        try:
+            return json.loads(self._validators_path.read_text())
+        except ValueError:
+            logger.warning("Broken plan validators file %s, ignored", self._validators_path)
+            return {}
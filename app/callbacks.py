@@ -1,7 +1,7 @@
 from aiogram.filters.callback_data import CallbackData
 from beanie import PydanticObjectId
 
-from app.enums import IdleReason, IdleType
+from app.enums import IdleReason, IdleType, PageKind
 
 
 class FinishProducts(CallbackData, prefix="finish_products"):
@@ -16,6 +16,10 @@ class Operator(CallbackData, prefix="operator"):
     id: PydanticObjectId
 
 
+class OperatorPage(CallbackData, prefix="operator_page"):
+    page: int
+
+
 class Order(CallbackData, prefix="order"):
     id: PydanticObjectId
 
@@ -28,6 +32,14 @@ class Product(CallbackData, prefix="product"):
     id: PydanticObjectId
 
 
+class ItemPage(CallbackData, prefix="item_page"):
+    # The parent (plan, order or bundle) comes from FSM data, the packed
+    # callback has to fit in 64 bytes.
+    kind: PageKind
+    anchor: PydanticObjectId
+    forward: bool
+
+
 class Idle(CallbackData, prefix="idle"):
     type: IdleType
 
@@ -6,6 +6,12 @@ class UserRole(StrEnum):
     ADMIN = "admin"
 
 
+class PageKind(StrEnum):
+    ORDER = "order"
+    BUNDLE = "bundle"
+    PRODUCT = "product"
+
+
 class IdleType(StrEnum):
     SCHEDULED = "scheduled"
     UNSCHEDULED = "unscheduled"
@@ -0,0 +1,232 @@
+import asyncio
+import gzip
+import json
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Iterable
+
+from beanie import Document
+from bson import json_util
+from pymongo import ReplaceOne
+
+from app.models import (
+    Account,
+    Bundle,
+    IdleEvent,
+    Operator,
+    Order,
+    Plan,
+    Product,
+    ProductionLine,
+    ProgressEvent,
+    Tombstone,
+)
+
+logger = logging.getLogger(__name__)
+
+# Collections and the field their high-water mark is taken from.
+# Documents tracked by _id or date are never updated after the insert.
+EXPORTED: tuple[tuple[type[Document], str], ...] = (
+    (Account, "updated_at"),
+    (Operator, "updated_at"),
+    (ProductionLine, "_id"),
+    (Plan, "updated_at"),
+    (Order, "updated_at"),
+    (Bundle, "updated_at"),
+    (Product, "updated_at"),
+    (IdleEvent, "updated_at"),
+    (ProgressEvent, "date"),
+    (Tombstone, "deleted_at"),
+)
+# Marks set to the export start, the others to the last value exported.
+CLOCK_MARKS = frozenset({"updated_at", "deleted_at"})
+STATE_FILE = "state.json"
+SEGMENT_GLOB = "segment_*.ndjson.gz"
+WRITE_BATCH = 1000
+
+
+@dataclass
+class ExportResult:
+    segment: Path
+    documents: dict[str, int] = field(default_factory=dict)
+
+    def __str__(self) -> str:
+        counts = ", ".join(
+            f"{name}: {count}" for name, count in self.documents.items()
+        )
+        return f"{self.segment.name} ({counts or 'no changes'})"
+
+
+class IncrementalExport:
+    """
+    Writes the documents changed since the previous run as one gzipped
+    NDJSON segment per run. The first run, without a state file, exports
+    everything and serves as the base.
+
+    Time marks are moved back by `overlap` on every run, so writes racing
+    with an export, or progress events committed late with an earlier
+    date, are picked up again by the next one. Restoring the same
+    document twice is harmless. Deletions travel as tombstones.
+    """
+
+    def __init__(
+        self, path: str | Path, overlap: timedelta = timedelta(minutes=1)
+    ):
+        self.path = Path(path)
+        self.overlap = overlap
+
+    async def export(self) -> ExportResult:
+        self.path.mkdir(parents=True, exist_ok=True)
+        state = self._load_state()
+        number = state.get("segment", 0) + 1
+        marks: dict[str, str] = state.get("marks", {})
+        segment = self.path / f"segment_{number:06d}.ndjson.gz"
+        result = ExportResult(segment)
+
+        started = datetime.utcnow()
+        with gzip.open(
+            segment.with_suffix(".tmp"), "wt", encoding="utf-8"
+        ) as file:
+            await self._write(
+                file,
+                [{"segment": number, "created_at": started, "marks": marks}],
+            )
+            for model, mark_field in EXPORTED:
+                name = model.get_settings().name
+                collection = model.get_motor_collection()
+                query: dict[str, Any] = {}
+                if (mark := marks.get(name)) is not None:
+                    mark_value = json_util.loads(mark)
+                    if mark_field == "_id":
+                        query = {mark_field: {"$gt": mark_value}}
+                    elif isinstance(mark_value, datetime):
+                        query = {
+                            mark_field: {"$gte": mark_value - self.overlap}
+                        }
+                    # Otherwise the mark was an _id of an older state, the
+                    # collection is exported in full once.
+
+                count = 0
+                last_value = None
+                lines: list[dict] = []
+                # Sorted by the mark field, which its index covers.
+                async for document in collection.find(query).sort(
+                    mark_field, 1
+                ):
+                    lines.append({"collection": name, "document": document})
+                    last_value = document.get(mark_field)
+                    count += 1
+                    if len(lines) >= WRITE_BATCH:
+                        await self._write(file, lines)
+                        lines = []
+                await self._write(file, lines)
+                result.documents[name] = count
+
+                if mark_field in CLOCK_MARKS:
+                    marks[name] = json_util.dumps(started)
+                elif last_value is not None:
+                    marks[name] = json_util.dumps(last_value)
+
+        segment.with_suffix(".tmp").rename(segment)
+        self._save_state({"segment": number, "marks": marks})
+        return result
+
+    @staticmethod
+    async def _write(file: Any, lines: list[dict]) -> None:
+        # Encoding and compression both run off the event loop.
+        if lines:
+            await asyncio.to_thread(
+                file.writelines,
+                (json_util.dumps(line) + "\n" for line in lines),
+            )
+
+    def _load_state(self) -> dict:
+        state_path = self.path / STATE_FILE
+        if not state_path.exists():
+            return {}
+        return json.loads(state_path.read_text())
+
+    def _save_state(self, state: dict) -> None:
+        state_path = self.path / STATE_FILE
+        state_path.with_suffix(".tmp").write_text(json.dumps(state, indent=2))
+        state_path.with_suffix(".tmp").replace(state_path)
+
+
+def read_segment(segment: Path) -> Iterable[dict]:
+    with gzip.open(segment, "rt", encoding="utf-8") as file:
+        for line in file:
+            yield json_util.loads(line)
+
+
+async def restore_segment(segment: Path, database: Any) -> dict[str, int]:
+    """
+    Replays one segment on top of the database: changed documents are
+    upserted by _id, append-only ones are inserted if missing, and the
+    documents named by tombstones are deleted.
+    """
+    mark_fields = {model.get_settings().name: mark for model, mark in EXPORTED}
+    tombstones = Tombstone.get_settings().name
+    deleted: dict[str, list] = {}
+    pending: dict[str, list[dict]] = {}
+    restored: dict[str, int] = {}
+
+    async def flush(name: str) -> None:
+        documents = pending.pop(name, [])
+        if not documents:
+            return
+        collection = database[name]
+        if mark_fields.get(name) in CLOCK_MARKS:
+            await collection.bulk_write(
+                [
+                    ReplaceOne({"_id": doc["_id"]}, doc, upsert=True)
+                    for doc in documents
+                ],
+                ordered=False,
+            )
+        else:
+            # Time series collections take inserts only.
+            existing = {
+                doc["_id"]
+                async for doc in collection.find(
+                    {"_id": {"$in": [doc["_id"] for doc in documents]}},
+                    projection={"_id": 1},
+                )
+            }
+            new = [doc for doc in documents if doc["_id"] not in existing]
+            if new:
+                await collection.insert_many(new, ordered=False)
+        restored[name] = restored.get(name, 0) + len(documents)
+
+    for line in await asyncio.to_thread(list, read_segment(segment)):
+        # Skips the header and the _id lists of older segments.
+        if (name := line.get("collection")) is None or "document" not in line:
+            continue
+        document = line["document"]
+        if name == tombstones:
+            deleted.setdefault(document["collection"], []).append(
+                document["document_id"]
+            )
+        pending.setdefault(name, []).append(document)
+        if len(pending[name]) >= WRITE_BATCH:
+            await flush(name)
+    for name in list(pending):
+        await flush(name)
+
+    # After the upserts: a document changed and then deleted within the
+    # segment's window must not come back.
+    for name, ids in deleted.items():
+        for start in range(0, len(ids), WRITE_BATCH):
+            result = await database[name].delete_many(
+                {"_id": {"$in": ids[start : start + WRITE_BATCH]}}
+            )
+            if result.deleted_count:
+                logger.info(
+                    "%s: %s documents deleted", name, result.deleted_count
+                )
+    return restored
+
+
+def list_segments(path: str | Path) -> list[Path]:
+    return sorted(Path(path).glob(SEGMENT_GLOB))
@@ -1 +1,3 @@
+from .account_cache import AccountCache
+from .cache import TTLCache
 from .localizator import Localizator
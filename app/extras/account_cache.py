@@ -0,0 +1,62 @@
+import logging
+
+from redis.asyncio.client import Redis
+from redis.exceptions import RedisError
+
+from app.extras.cache import TTLCache
+from app.models import Account
+
+logger = logging.getLogger(__name__)
+
+NO_ACCOUNT = ""
+
+
+class AccountCache:
+    def __init__(
+        self,
+        redis: Redis,
+        prefix: str,
+        local_ttl: float = 30.0,
+        redis_ttl: int = 3600,
+        maxsize: int = 4096,
+    ) -> None:
+        self._redis = redis
+        self._prefix = prefix
+        self._redis_ttl = redis_ttl
+        self._local: TTLCache[int, str] = TTLCache(maxsize=maxsize, ttl=local_ttl)
+
+    async def get_role(self, tg_id: int) -> str | None:
+        if (role := self._local.get(tg_id)) is None:
+            role = await self._get_shared(tg_id)
+            self._local.set(tg_id, role)
+        return role or None
+
+    async def invalidate(self, tg_id: int | None) -> None:
+        if tg_id is None:
+            return
+        self._local.pop(tg_id)
+        try:
+            await self._redis.delete(self._key(tg_id))
+        except RedisError as e:
+            logger.error("Can't invalidate cached role of %s: %s", tg_id, e)
+
+    async def _get_shared(self, tg_id: int) -> str:
+        key = self._key(tg_id)
+        try:
+            cached = await self._redis.get(key)
+        except RedisError as e:
+            logger.warning("Role cache is unavailable: %s", e)
+            cached = None
+        if cached is not None:
+            return cached.decode() if isinstance(cached, bytes) else cached
+
+        account = await Account.by_tg_id(tg_id)
+        role = account.role if account is not None else NO_ACCOUNT
+        try:
+            await self._redis.set(key, role, ex=self._redis_ttl)
+        except RedisError as e:
+            logger.warning("Role cache is unavailable: %s", e)
+        return role
+
+    def _key(self, tg_id: int) -> str:
+        return f"{self._prefix}:account_role:{tg_id}"
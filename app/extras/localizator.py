@@ -1,46 +1,105 @@
+import asyncio
 import csv
+import logging
+import string
 from pathlib import Path
-from typing import Any, Iterable
+from typing import Any, Callable, Iterable
 
 LOCALES_KEY = "locale"
 
+logger = logging.getLogger(__name__)
+
+# (key, lang) -> (text, formatter); formatter is None for static texts.
+Table = dict[tuple[str, str], tuple[str, Callable[..., str] | None]]
+
 
 class Localizator:
-    def __init__(self, filepath: Path, default_lang: str = "ru") -> None:
-        self.__filepath = filepath
+    def __init__(self, filepath: Path | str, default_lang: str = "ru") -> None:
+        self.__filepath = Path(filepath)
         self.__default_lang = default_lang.lower()
         if not self.__filepath.exists():
             raise Exception("Locales file not found!")
+        self.version = 0
         self.reload_locales()
 
     def reload_locales(self) -> None:
-        self.__texts, self.__locales = self.__read_locales()
+        self.__apply(self.__compile())
+
+    async def watch(self, interval: float = 2.0) -> None:
+        """Reloads the texts whenever the file's mtime changes."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                mtime = (
+                    await asyncio.to_thread(self.__filepath.stat)
+                ).st_mtime_ns
+                if mtime == self.__mtime:
+                    continue
+                self.__apply(await asyncio.to_thread(self.__compile))
+            except Exception as e:
+                # A half-saved or broken file keeps the previous texts.
+                logger.error("Can't reload %s: %s", self.__filepath, e)
+                continue
+            logger.info("Locales reloaded, version %s", self.version)
 
     def available_locales(self) -> tuple[str, ...]:
-        return tuple(self.__locales.keys())
+        return self.__locales
 
     def available_keys(self) -> tuple[str, ...]:
-        return tuple(self.__texts.keys())
+        return self.__keys
 
     def get_text(self, key: str, *args: Any, lang: str | None = None) -> str:
-        _lang = lang.lower() if lang else self.__default_lang
-        if (
-            (locale_id := self.__locales.get(_lang)) is None
-            or (text := self.__texts.get(key)) is None
-        ):
+        entry = self.__table.get(
+            (key, lang.lower() if lang else self.__default_lang)
+        )
+        if entry is None:
             return key
-        return text[locale_id].format(*args) if args else text[locale_id]
+        text, formatter = entry
+        return formatter(*args) if args and formatter is not None else text
 
-    def __read_locales(self) -> tuple[dict[str, tuple[str, ...]], dict[str, int]]:
+    def __apply(
+        self, compiled: tuple[Table, tuple[str, ...], tuple[str, ...], int]
+    ) -> None:
+        # Swapped in one go, readers never see a half-built table.
+        self.__table, self.__keys, self.__locales, self.__mtime = compiled
+        self.version += 1
+
+    def __compile(self) -> tuple[Table, tuple[str, ...], tuple[str, ...], int]:
+        mtime = self.__filepath.stat().st_mtime_ns
+        texts = self.__read_locales()
+        if LOCALES_KEY not in texts:
+            raise Exception("Locales names not found.")
+        locales = self.__available_locales(texts[LOCALES_KEY])
+        table: Table = {}
+        for key, values in texts.items():
+            for lang, i in locales.items():
+                if i >= len(values):
+                    continue
+                text = values[i]
+                table[key, lang] = (
+                    text,
+                    text.format if _has_fields(text) else None,
+                )
+        return table, tuple(texts), tuple(locales), mtime
+
+    def __read_locales(self) -> dict[str, tuple[str, ...]]:
         __texts: dict[str, tuple[str, ...]] = {}
         with self.__filepath.open(encoding="utf-8") as csv_file:
             csv_reader = csv.reader(csv_file, delimiter=",", quotechar='"')
             for row in csv_reader:
                 key, *texts = row
                 __texts[key] = tuple(texts)
-        if LOCALES_KEY not in __texts:
-            raise Exception("Locales names not found.")
-        return __texts, self.__available_locales(__texts[LOCALES_KEY])
+        return __texts
 
     def __available_locales(self, locales: Iterable[str]) -> dict[str, int]:
         return {locale.lower(): i for i, locale in enumerate(locales)}
+
+
+def _has_fields(text: str) -> bool:
+    try:
+        return any(
+            field is not None
+            for _, field, _, _ in string.Formatter().parse(text)
+        )
+    except ValueError:
+        return False
@@ -0,0 +1,203 @@
+import json
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any
+
+from pymongo import monitoring
+
+from .prometheus import Registry
+
+logger = logging.getLogger(__name__)
+
+# Where each command keeps the filter its shape is taken from.
+FILTERS = {
+    "find": lambda command: command.get("filter"),
+    "aggregate": lambda command: command.get("pipeline"),
+    "update": lambda command: command["updates"][0].get("q"),
+    "delete": lambda command: command["deletes"][0].get("q"),
+    "findAndModify": lambda command: command.get("query"),
+    "count": lambda command: command.get("query"),
+    "distinct": lambda command: command.get("query"),
+    "insert": lambda command: None,
+    "getMore": lambda command: None,
+}
+
+
+@dataclass
+class UpdateQueries:
+    update_id: int | None
+    shapes: Counter[str] = field(default_factory=Counter)
+    durations: defaultdict[str, float] = field(
+        default_factory=lambda: defaultdict(float)
+    )
+    failed: int = 0
+    # Motor runs commands, and so the listener, on its executor threads.
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, shape: str, duration: float, succeeded: bool) -> None:
+        with self.lock:
+            self.shapes[shape] += 1
+            self.durations[shape] += duration
+            self.failed += not succeeded
+
+    def repeated(self, threshold: int) -> list[tuple[str, int]]:
+        return [
+            (shape, count)
+            for shape, count in self.shapes.most_common()
+            if count > threshold
+        ]
+
+    def summary(self, top: int = 5) -> str:
+        total = sum(self.shapes.values())
+        spent = sum(self.durations.values()) * 1000
+        hot = sorted(self.durations.items(), key=lambda item: -item[1])[:top]
+        lines = [
+            f"update {self.update_id}: {total} queries, {spent:.1f} ms"
+            + (f", {self.failed} failed" if self.failed else "")
+        ]
+        lines.extend(
+            f"  {self.shapes[shape]:>3} x {duration * 1000:7.1f} ms  {shape}"
+            for shape, duration in hot
+        )
+        return "\n".join(lines)
+
+
+current_queries: ContextVar[UpdateQueries | None] = ContextVar(
+    "current_queries", default=None
+)
+
+
+def query_shape(value: Any) -> Any:
+    """Replaces the values of a filter or pipeline, keeping its keys."""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if (
+        isinstance(value, list)
+        and value
+        and all(isinstance(item, dict) for item in value)
+    ):
+        return [query_shape(item) for item in value]
+    return "?"
+
+
+class CommandMonitor(monitoring.CommandListener):
+    def __init__(self, registry: Registry) -> None:
+        self.latency = registry.histogram(
+            "mongo_command_duration_seconds",
+            "Time spent in MongoDB commands",
+            ("collection", "command"),
+        )
+        self.failures = registry.counter(
+            "mongo_command_failures_total",
+            "Failed MongoDB commands",
+            ("collection", "command"),
+        )
+        self._lock = threading.Lock()
+        self._started: dict[tuple[Any, int], tuple[str, str | None]] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        if (get_filter := FILTERS.get(event.command_name)) is None:
+            return
+        command = event.command
+        if event.command_name == "getMore":
+            collection = command.get("collection", "?")
+        else:
+            collection = command.get(event.command_name, "?")
+        shape = None
+        # Shapes are only needed while an update is being tracked.
+        if current_queries.get() is not None:
+            shape = "{} {} {}".format(
+                event.command_name,
+                collection,
+                json.dumps(
+                    query_shape(get_filter(command)),
+                    sort_keys=True,
+                    default=str,
+                ),
+            )
+        with self._lock:
+            self._started[event.connection_id, event.request_id] = (
+                collection,
+                shape,
+            )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._finish(event, succeeded=True)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._finish(event, succeeded=False)
+
+    def _finish(
+        self,
+        event: (
+            monitoring.CommandSucceededEvent | monitoring.CommandFailedEvent
+        ),
+        succeeded: bool,
+    ) -> None:
+        with self._lock:
+            started = self._started.pop(
+                (event.connection_id, event.request_id), None
+            )
+        if started is None:
+            return
+        collection, shape = started
+        duration = event.duration_micros / 1_000_000
+        labels = (collection, event.command_name)
+        self.latency.observe(labels, duration)
+        if not succeeded:
+            self.failures.inc(labels)
+        if (
+            shape is not None
+            and (queries := current_queries.get()) is not None
+        ):
+            queries.record(shape, duration, succeeded)
+
+
+class track_queries:
+    """
+    Collects the commands issued while the block runs, then logs a
+    summary and, if warn_threshold is set, every query shape that
+    repeated more often than that: usually a query inside a loop.
+    """
+
+    def __init__(
+        self, update_id: int | None, warn_threshold: int | None = None
+    ) -> None:
+        self.queries = UpdateQueries(update_id)
+        self.warn_threshold = warn_threshold
+
+    def __enter__(self) -> UpdateQueries:
+        self._started = time.perf_counter()
+        self._token = None
+        # Off unless there is something to report: the monitor then
+        # skips building query shapes altogether.
+        if self.warn_threshold is not None or logger.isEnabledFor(
+            logging.DEBUG
+        ):
+            self._token = current_queries.set(self.queries)
+        return self.queries
+
+    def __exit__(self, *exc_info: Any) -> None:
+        if self._token is None:
+            return
+        current_queries.reset(self._token)
+        if not self.queries.shapes:
+            return
+        logger.debug(
+            "%s (handled in %.1f ms)",
+            self.queries.summary(),
+            (time.perf_counter() - self._started) * 1000,
+        )
+        if self.warn_threshold is None:
+            return
+        for shape, count in self.queries.repeated(self.warn_threshold):
+            logger.warning(
+                "Possible N+1 in update %s: %s queries of %s",
+                self.queries.update_id,
+                count,
+                shape,
+            )
@@ -0,0 +1,155 @@
+import bisect
+import threading
+from collections import defaultdict
+from typing import Iterable
+
+from aiohttp import web
+
+LabelValues = tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(names: Iterable[str], values: LabelValues, **extra: str) -> str:
+    pairs = [*zip(names, values), *extra.items()]
+    if not pairs:
+        return ""
+    escaped = (
+        (
+            name,
+            value.replace("\\", r"\\")
+            .replace('"', r"\"")
+            .replace("\n", r"\n"),
+        )
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Counter:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: LabelValues,
+        lock: threading.Lock,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = lock
+        self._values: dict[LabelValues, float] = defaultdict(float)
+
+    def inc(self, labels: LabelValues, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] += amount
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        for labels, value in self._values.items():
+            lines.append(
+                f"{self.name}{_labels(self.labelnames, labels)} {value}"
+            )
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: LabelValues,
+        lock: threading.Lock,
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._lock = lock
+        # Per bucket counts, the last slot is +Inf.
+        self._counts: dict[LabelValues, list[int]] = {}
+        self._sums: dict[LabelValues, float] = defaultdict(float)
+
+    def observe(self, labels: LabelValues, value: float) -> None:
+        with self._lock:
+            if (counts := self._counts.get(labels)) is None:
+                counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sums[labels] += value
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for labels, counts in self._counts.items():
+            total = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                total += count
+                le = _labels(self.labelnames, labels, le=str(bound))
+                lines.append(f"{self.name}_bucket{le} {total}")
+            label_str = _labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {self._sums[labels]}")
+            lines.append(f"{self.name}_count{label_str} {total}")
+        return lines
+
+
+class Registry:
+    """
+    Metrics are updated from motor's executor threads too, so they all
+    share one lock with render(): the caller of a metric's own render()
+    must hold it.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._metrics: list[Counter | Histogram] = []
+
+    def counter(
+        self, name: str, documentation: str, labelnames: LabelValues = ()
+    ) -> Counter:
+        metric = Counter(name, documentation, labelnames, self._lock)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: LabelValues = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        metric = Histogram(
+            name, documentation, labelnames, self._lock, buckets
+        )
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            lines = [
+                line for metric in self._metrics for line in metric.render()
+            ]
+        return "\n".join(lines) + "\n"
+
+
+async def serve_metrics(
+    registry: Registry, host: str, port: int
+) -> web.AppRunner:
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(
+            text=registry.render(),
+            content_type="text/plain",
+            headers={"X-Content-Type-Options": "nosniff"},
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
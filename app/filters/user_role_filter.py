@@ -1,7 +1,7 @@
 from aiogram.filters import BaseFilter
 from aiogram.types import CallbackQuery, Message
 
-from app.models import Account
+from loaders import account_cache
 
 
 class UserRoleFilter(BaseFilter):
@@ -10,7 +10,6 @@ class UserRoleFilter(BaseFilter):
 
     async def __call__(self, obj: Message | CallbackQuery) -> bool:
         return (
-            obj.from_user is not None and
-            (user := await Account.by_tg_id(obj.from_user.id)) is not None
-            and user.role == self.role
+            obj.from_user is not None
+            and await account_cache.get_role(obj.from_user.id) == self.role
         )
@@ -0,0 +1,4 @@
+from .buffered_storage import BufferedStorage
+from .compaction import CompactionReport, FSMCompactor
+from .serializers import get_serializer, Serializer
+from .ttl import StateTTL
@@ -0,0 +1,172 @@
+import logging
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, AsyncIterator
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.redis import KeyBuilder
+from redis.asyncio.client import Pipeline, Redis
+from redis.exceptions import RedisError
+
+from .serializers import JSONSerializer, Serializer
+from .ttl import StateTTL
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Entry:
+    state: str | None = None
+    data: dict[str, Any] | None = None
+    state_loaded: bool = False
+    data_loaded: bool = False
+    state_dirty: bool = False
+    data_dirty: bool = False
+
+
+_buffer: ContextVar[dict[StorageKey, _Entry] | None] = ContextVar(
+    "fsm_buffer", default=None
+)
+
+
+class BufferedStorage(BaseStorage):
+    def __init__(
+        self,
+        redis: Redis,
+        key_builder: KeyBuilder,
+        serializer: Serializer | None = None,
+        ttl: StateTTL | None = None,
+    ) -> None:
+        self.redis = redis
+        self.key_builder = key_builder
+        self.serializer = serializer or JSONSerializer()
+        self.ttl = ttl or StateTTL()
+
+    @asynccontextmanager
+    async def buffer(self) -> AsyncIterator[None]:
+        if _buffer.get() is not None:
+            yield
+            return
+        token = _buffer.set({})
+        try:
+            yield
+        finally:
+            entries = _buffer.get() or {}
+            _buffer.reset(token)
+            # Writes made before a handler failed are kept, as they were
+            # when every call went straight to Redis.
+            await self.flush(entries)
+
+    def seed_state(self, key: StorageKey, state: str | None) -> None:
+        if (entry := self._entry(key)) is not None and not entry.state_loaded:
+            entry.state = state
+            entry.state_loaded = True
+
+    async def set_state(
+        self, key: StorageKey, state: StateType = None
+    ) -> None:
+        entry = self._entry(key) or _Entry()
+        entry.state = state.state if isinstance(state, State) else state
+        entry.state_loaded = entry.state_dirty = True
+        if _buffer.get() is None:
+            await self.flush({key: entry})
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        if (entry := self._entry(key)) is None:
+            return await self._read_state(key)
+        if not entry.state_loaded:
+            entry.state = await self._read_state(key)
+            entry.state_loaded = True
+        return entry.state
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        entry = self._entry(key) or _Entry()
+        entry.data = data.copy()
+        entry.data_loaded = entry.data_dirty = True
+        if _buffer.get() is None:
+            await self.flush({key: entry})
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        if (entry := self._entry(key)) is None:
+            return await self._read_data(key)
+        if not entry.data_loaded:
+            entry.data = await self._read_data(key)
+            entry.data_loaded = True
+        return (entry.data or {}).copy()
+
+    async def update_data(
+        self, key: StorageKey, data: dict[str, Any]
+    ) -> dict[str, Any]:
+        current_data = await self.get_data(key)
+        current_data.update(data)
+        await self.set_data(key, current_data)
+        return current_data.copy()
+
+    async def close(self) -> None:
+        await self.redis.aclose(close_connection_pool=True)
+
+    async def flush(self, entries: dict[StorageKey, _Entry]) -> None:
+        dirty = {
+            key: entry
+            for key, entry in entries.items()
+            if entry.state_dirty or entry.data_dirty
+        }
+        if not dirty:
+            return
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                for key, entry in dirty.items():
+                    self._queue(pipe, key, entry)
+                await pipe.execute()
+        except RedisError as e:
+            logger.warning(
+                "Pipelined FSM flush failed (%s), writing keys one by one", e
+            )
+            for key, entry in dirty.items():
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    self._queue(pipe, key, entry)
+                    await pipe.execute()
+
+    async def _read_state(self, key: StorageKey) -> str | None:
+        value = await self.redis.get(self.key_builder.build(key, "state"))
+        if isinstance(value, bytes):
+            return value.decode()
+        return value
+
+    async def _read_data(self, key: StorageKey) -> dict[str, Any]:
+        value = await self.redis.get(self.key_builder.build(key, "data"))
+        if value is None:
+            return {}
+        if isinstance(value, str):
+            value = value.encode()
+        return self.serializer.loads(value)
+
+    def _queue(self, pipe: Pipeline, key: StorageKey, entry: _Entry) -> None:
+        # Without a known state the data key falls back to the default TTL.
+        ttl = self.ttl.for_state(entry.state)
+        state_key = self.key_builder.build(key, "state")
+        data_key = self.key_builder.build(key, "data")
+        if entry.state_dirty:
+            if entry.state is None:
+                pipe.delete(state_key)
+            else:
+                pipe.set(state_key, entry.state, ex=ttl)
+        if entry.data_dirty:
+            if not entry.data:
+                pipe.delete(data_key)
+            else:
+                pipe.set(data_key, self.serializer.dumps(entry.data), ex=ttl)
+        elif entry.state_dirty and entry.state is not None:
+            # Data follows the expiry of the state it belongs to.
+            if ttl is None:
+                pipe.persist(data_key)
+            else:
+                pipe.expire(data_key, ttl)
+
+    @staticmethod
+    def _entry(key: StorageKey) -> _Entry | None:
+        if (entries := _buffer.get()) is None:
+            return None
+        return entries.setdefault(key, _Entry())
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+
+from redis.asyncio.client import Redis
+from redis.exceptions import RedisError
+
+from .ttl import StateTTL
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CompactionReport:
+    keys: Counter[str] = field(default_factory=Counter)
+    memory: Counter[str] = field(default_factory=Counter)
+    expired: int = 0
+
+    def __str__(self) -> str:
+        groups = ", ".join(
+            f"{group}: {self.keys[group]} keys / {self.memory[group]} B"
+            for group, _ in self.memory.most_common()
+        )
+        return (
+            f"{sum(self.keys.values())} keys, "
+            f"{sum(self.memory.values())} B ({groups or '-'}), "
+            f"TTL applied to {self.expired}"
+        )
+
+
+class FSMCompactor:
+    """
+    Walks every key under the bot prefix, reports memory per key group
+    and gives an expiry to FSM keys written before TTLs were configured.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        prefix: str,
+        ttl: StateTTL,
+        batch_size: int = 500,
+    ) -> None:
+        self.redis = redis
+        self.prefix = prefix
+        self.ttl = ttl
+        self.batch_size = batch_size
+
+    async def run(self, interval: float) -> None:
+        while True:
+            try:
+                report = await self.compact()
+                logger.info("FSM compaction: %s", report)
+            except RedisError as e:
+                logger.warning("FSM compaction failed: %s", e)
+            await asyncio.sleep(interval)
+
+    async def compact(self) -> CompactionReport:
+        report = CompactionReport()
+        keys: list[bytes] = []
+        async for key in self.redis.scan_iter(
+            match=f"{self.prefix}:*", count=self.batch_size
+        ):
+            keys.append(key)
+            if len(keys) >= self.batch_size:
+                await self._process(keys, report)
+                keys = []
+        if keys:
+            await self._process(keys, report)
+        return report
+
+    async def _process(
+        self, keys: list[bytes], report: CompactionReport
+    ) -> None:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.memory_usage(key)
+                pipe.ttl(key)
+            stats = await pipe.execute()
+
+        persistent: list[str] = []
+        for i, key in enumerate(map(bytes.decode, keys)):
+            usage, ttl = stats[2 * i], stats[2 * i + 1]
+            group = self._group(key)
+            report.keys[group] += 1
+            report.memory[group] += usage or 0
+            if ttl == -1 and group in ("state", "data"):
+                persistent.append(key)
+        if persistent:
+            report.expired += await self._expire(persistent)
+
+    async def _expire(self, keys: list[str]) -> int:
+        # Data keys take the expiry of their state, so read those first.
+        state_keys = [self._sibling(key, "state") for key in keys]
+        states = await self.redis.mget(state_keys)
+        expired = 0
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, state in zip(keys, states):
+                if isinstance(state, bytes):
+                    state = state.decode()
+                if (ttl := self.ttl.for_state(state)) is None:
+                    continue
+                pipe.expire(key, ttl, nx=True)
+                expired += 1
+            await pipe.execute()
+        return expired
+
+    def _group(self, key: str) -> str:
+        # FSM keys end with their part, other keys are named after
+        # the segment that follows the prefix.
+        tail = key[len(self.prefix) + 1 :]
+        part = tail.rsplit(":", 1)[-1]
+        if part in ("state", "data", "lock"):
+            return part
+        return tail.split(":", 1)[0]
+
+    @staticmethod
+    def _sibling(key: str, part: str) -> str:
+        return f"{key.rsplit(':', 1)[0]}:{part}"
@@ -0,0 +1,70 @@
+import json
+from typing import Any, Protocol
+
+
+class Serializer(Protocol):
+    name: str
+
+    def dumps(self, data: dict[str, Any]) -> bytes: ...
+
+    def loads(self, raw: bytes) -> dict[str, Any]: ...
+
+
+class JSONSerializer:
+    name = "json"
+
+    def dumps(self, data: dict[str, Any]) -> bytes:
+        return json.dumps(data, separators=(",", ":")).encode()
+
+    def loads(self, raw: bytes) -> dict[str, Any]:
+        return json.loads(raw)
+
+
+class OrjsonSerializer:
+    name = "orjson"
+
+    def __init__(self) -> None:
+        import orjson
+
+        self._orjson = orjson
+
+    def dumps(self, data: dict[str, Any]) -> bytes:
+        return self._orjson.dumps(data)
+
+    def loads(self, raw: bytes) -> dict[str, Any]:
+        return self._orjson.loads(raw)
+
+
+class MsgpackSerializer:
+    name = "msgpack"
+
+    def __init__(self) -> None:
+        import msgpack
+
+        self._msgpack = msgpack
+
+    def dumps(self, data: dict[str, Any]) -> bytes:
+        return self._msgpack.packb(data, use_bin_type=True)
+
+    def loads(self, raw: bytes) -> dict[str, Any]:
+        # A msgpack map never starts with "{", so values written before
+        # the switch are still readable until they are rewritten.
+        if raw[:1] == b"{":
+            return json.loads(raw)
+        return self._msgpack.unpackb(raw, raw=False)
+
+
+SERIALIZERS: dict[str, type[Serializer]] = {
+    JSONSerializer.name: JSONSerializer,
+    OrjsonSerializer.name: OrjsonSerializer,
+    MsgpackSerializer.name: MsgpackSerializer,
+}
+
+
+def get_serializer(name: str) -> Serializer:
+    if (serializer := SERIALIZERS.get(name.lower())) is None:
+        raise ValueError(
+            f"Unknown FSM serializer {name!r}, "
+            f"expected one of: {', '.join(SERIALIZERS)}"
+        )
+    return serializer()
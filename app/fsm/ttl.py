@@ -0,0 +1,22 @@
+class StateTTL:
+    """
+    Expiry of FSM keys, looked up by the full state name
+    ("AccountStates:idle"), then by its group ("AccountStates").
+    None means the key never expires.
+    """
+
+    def __init__(
+        self,
+        default: int | None = None,
+        overrides: dict[str, int] | None = None,
+    ) -> None:
+        self.default = default
+        self.overrides = overrides or {}
+
+    def for_state(self, state: str | None) -> int | None:
+        if state is None:
+            return self.default
+        if state in self.overrides:
+            return self.overrides[state]
+        group = state.split(":", 1)[0]
+        return self.overrides.get(group, self.default)
@@ -5,12 +5,13 @@ from aiogram.types import CallbackQuery, Message
 from app.enums import UserRole
 from app.extras import helpers
 from app.filters import UserRoleFilter
+from app.handlers.operator import invalidate_operator_pages
 from app.keyboards import KeyboardCollection
 from app.models import Account, Operator, ProductionLine
 from app.states import AdminStates
 from loaders import loc
 
-router = Router()
+router = Router(name="admin")
 router.message.filter(F.from_user.id != F.bot.id)
 router.message.filter(UserRoleFilter(UserRole.ADMIN))
 router.callback_query.filter(UserRoleFilter(UserRole.ADMIN))
@@ -81,9 +82,9 @@ async def handle_line_btn(callback: CallbackQuery, state: FSMContext) -> None:
         name=operator_name,
         rate=operator_rate,
         line_id=line.id,
-        progress_log=[],
     )
     await new_operator.insert()
+    invalidate_operator_pages()
 
     await callback.answer(loc.get_text("admin/operator/added"))
     await main(callback, state)
@@ -4,7 +4,7 @@ from app.models import Account
 from loaders import loc
 
 
-router = Router()
+router = Router(name="bot_sleep")
 router.message.filter(F.from_user.id != F.bot.id)
 
 
@@ -1,21 +1,26 @@
 import logging
+from typing import Callable, TypeVar
 
 from aiogram import F, Router
 from aiogram.filters import StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, Message
-from aiogram_widgets.pagination import KeyboardPaginator
+from beanie import BeanieObjectId
+from beanie.operators import CurrentDate, Set
 
 from app import callbacks
-from app.enums import IdleType, UserRole
-from app.extras import helpers
+from app.enums import IdleType, PageKind, UserRole
+from app.extras import TTLCache, helpers
 from app.filters import UserRoleFilter
 from app.keyboards import KeyboardCollection
+from app.middlewares import UpdateContext, UpdateContextMiddleware
 from app.models import (
     Bundle,
     Operator,
     Order,
+    Page,
     Plan,
+    PlanTree,
     Product,
     ProductionLine,
 )
@@ -24,10 +29,112 @@ from loaders import bot, loc
 
 logger = logging.getLogger()
 
-router = Router()
+Node = TypeVar("Node")
+
+router = Router(name="operator")
 router.message.filter(F.from_user.id != F.bot.id)
 router.message.filter(UserRoleFilter(UserRole.OPERATOR))
 router.callback_query.filter(UserRoleFilter(UserRole.OPERATOR))
+router.message.outer_middleware(UpdateContextMiddleware())
+router.callback_query.outer_middleware(UpdateContextMiddleware())
+
+# Plan structure without products. Finished flags in it are as of the load,
+# the keyboards read them live through item_pages.
+plan_trees: TTLCache[str, PlanTree] = TTLCache(maxsize=4, ttl=300)
+
+ITEMS_PER_PAGE = 10
+# (kind, parent id, anchor, forward): kept briefly, operators flip back and forth.
+item_pages: TTLCache[tuple[PageKind, str, str | None, bool], Page] = TTLCache(
+    maxsize=256, ttl=15
+)
+PAGE_PARENTS = {
+    PageKind.ORDER: "plan_id",
+    PageKind.BUNDLE: "order_id",
+    PageKind.PRODUCT: "bundle_id",
+}
+PAGE_FETCHERS = {
+    PageKind.ORDER: Order.page_active,
+    PageKind.BUNDLE: Bundle.page_active,
+    PageKind.PRODUCT: Product.page_active,
+}
+
+
+async def get_plan_tree(plan_id: str | None = None, plan: Plan | None = None) -> PlanTree | None:
+    if plan is not None:
+        plan_id = str(plan.id)
+    if plan_id is not None and (tree := plan_trees.get(plan_id)) is not None:
+        return tree
+    if plan is None:
+        plan = await (Plan.get(plan_id) if plan_id else Plan.get_current())
+    if plan is None:
+        return None
+    tree = await plan.load_tree(products=False)
+    plan_trees.set(str(plan.id), tree)
+    return tree
+
+
+async def get_plan_node(
+    plan_id: str | None, find: Callable[[PlanTree], Node | None]
+) -> Node | None:
+    """
+    Finds an order or bundle in the cached tree. The keyboards are paged
+    live, so a miss may be a node added by a plan sync since the tree was
+    cached: the tree is then reloaded once before giving up.
+    """
+    if (tree := await get_plan_tree(plan_id)) is None:
+        return None
+    if (node := find(tree)) is not None:
+        return node
+    plan_trees.pop(str(tree.id))
+    if (tree := await get_plan_tree(str(tree.id))) is None:
+        return None
+    return find(tree)
+
+
+def invalidate_item_pages(kind: PageKind, parent_id: BeanieObjectId | str) -> None:
+    """Drops the cached pages of one parent after its items changed."""
+    parent_id = str(parent_id)
+    item_pages.evict(lambda key: key[0] == kind and key[1] == parent_id)
+
+
+async def get_item_page(
+    kind: PageKind,
+    parent_id: str,
+    anchor: BeanieObjectId | None = None,
+    forward: bool = True,
+) -> Page:
+    key = (kind, parent_id, None if anchor is None else str(anchor), forward)
+    if (page := item_pages.get(key)) is None:
+        page = await PAGE_FETCHERS[kind](
+            BeanieObjectId(parent_id), anchor, forward, ITEMS_PER_PAGE
+        )
+        item_pages.set(key, page)
+    return page
+
+
+OPERATORS_PER_PAGE = 10
+operator_pages: TTLCache[tuple[str, int], list[Operator]] = TTLCache(maxsize=64, ttl=60)
+operator_counts: TTLCache[str, int] = TTLCache(maxsize=16, ttl=60)
+
+
+async def get_operator_page(line_id: str, page: int) -> tuple[list[Operator], int, int]:
+    """Returns the operators of the page, the page clamped to range and the page count."""
+    if (count := operator_counts.get(line_id)) is None:
+        count = await Operator.count_by_line(BeanieObjectId(line_id))
+        operator_counts.set(line_id, count)
+    pages = max(1, -(-count // OPERATORS_PER_PAGE))
+    page = min(max(page, 0), pages - 1)
+    if (operators := operator_pages.get((line_id, page))) is None:
+        operators = await Operator.page_by_line(
+            BeanieObjectId(line_id), page, OPERATORS_PER_PAGE
+        )
+        operator_pages.set((line_id, page), operators)
+    return operators, page, pages
+
+
+def invalidate_operator_pages() -> None:
+    operator_pages.clear()
+    operator_counts.clear()
 
 
 async def choose_line(obj: Message | CallbackQuery, state: FSMContext) -> None:
@@ -47,50 +154,57 @@ async def choose_line(obj: Message | CallbackQuery, state: FSMContext) -> None:
 
 @router.callback_query(callbacks.Line.filter(), AccountStates.choose_line)
 async def handle_chosen_line(
-    callback: CallbackQuery, state: FSMContext, callback_data: callbacks.Line | None = None
+    callback: CallbackQuery,
+    state: FSMContext,
+    ctx: UpdateContext,
+    callback_data: callbacks.Line | None = None,
 ) -> None:
     logger.debug("handle_chosen_line")
     if (message := await helpers.hide_markup_or_delete(callback)) is None:
         return
     if callback_data is not None:
-        line_id = callback_data.id
-        await state.update_data(line_id=str(line_id))
-    else:
-        storage_data = await state.get_data()
-        line_id = storage_data.get("line_id")
-
-    if (line := await ProductionLine.get(line_id)) is None:
+        await ctx.update_data(line_id=str(callback_data.id))
+    if (line := await ctx.line()) is None:
         return
 
     await state.set_state(AccountStates.choose_operator)
-    operators = await Operator.find(Operator.line_id == line.id).to_list()
-
-    kbc = KeyboardCollection()
-    operator_buttons = kbc.operator_buttons(operators)
-    paginator = KeyboardPaginator(
-        data=operator_buttons,
-        router=router,
-        per_page=10,
-        per_row=2,
-        additional_buttons=kbc.return_button_row(),
+    operators, page, pages = await get_operator_page(str(line.id), 0)
+    await message.answer(
+        loc.get_text("operator/choose_operator"),
+        reply_markup=KeyboardCollection().choose_operator_keyboard(operators, page, pages),
     )
 
-    await message.answer(
-        loc.get_text("operator/choose_operator"), reply_markup=paginator.as_markup()
+
+@router.callback_query(callbacks.OperatorPage.filter(), AccountStates.choose_operator)
+async def handle_operator_page(
+    callback: CallbackQuery,
+    ctx: UpdateContext,
+    callback_data: callbacks.OperatorPage,
+) -> None:
+    logger.debug("handle_operator_page")
+    if callback.message is None or (line_id := (await ctx.get_data()).get("line_id")) is None:
+        await callback.answer()
+        return
+    operators, page, pages = await get_operator_page(line_id, callback_data.page)
+    await callback.message.edit_reply_markup(
+        reply_markup=KeyboardCollection().choose_operator_keyboard(operators, page, pages)
     )
+    await callback.answer()
 
 
 @router.callback_query(callbacks.Operator.filter(), AccountStates.choose_operator)
 async def handle_chosen_operator(
-    callback: CallbackQuery, state: FSMContext, callback_data: callbacks.Operator
+    callback: CallbackQuery,
+    state: FSMContext,
+    ctx: UpdateContext,
+    callback_data: callbacks.Operator,
 ) -> None:
     logger.debug("handle_chosen_operator")
     if (message := await helpers.hide_markup_or_delete(callback)) is None:
         return
 
-    operator_id = callback_data.id
-    await state.update_data(operator_id=str(operator_id))
-    if (operator := await Operator.get(operator_id)) is None:
+    await ctx.update_data(operator_id=str(callback_data.id))
+    if (operator := await ctx.operator()) is None:
         return
 
     await state.set_state(AccountStates.choose_action)
@@ -101,32 +215,32 @@ async def handle_chosen_operator(
 
 
 @router.callback_query(F.data == "start_shift", AccountStates.choose_action)
-async def handle_start_shift_btn(callback: CallbackQuery, state: FSMContext) -> None:
+async def handle_start_shift_btn(
+    callback: CallbackQuery, state: FSMContext, ctx: UpdateContext
+) -> None:
     logger.debug("handle_start_shift_btn")
     if (message := await helpers.hide_markup_or_delete(callback)) is None:
         return
 
-    await state.update_data(order_id=None, bundle_id=None)
+    await ctx.update_data(order_id=None, bundle_id=None)
 
-    storage_data = await state.get_data()
-    if (operator_id := storage_data.get("operator_id")) is None:
-        return
-    if (operator := await Operator.get(operator_id)) is None:
+    if (operator := await ctx.operator()) is None:
         return
     if (plan := await Plan.get_current()) is None:
         await callback.answer(loc.get_text("operator/no_plan"))
         return
 
+    await ctx.update_data(plan_id=str(plan.id))
     await state.set_state(AccountStates.choose_order)
-    orders = await plan.get_active_orders()
+    orders = await get_item_page(PageKind.ORDER, str(plan.id))
     text = loc.get_text("operator/choose_order")
-    if not orders:
+    if not orders.items:
         text = loc.get_text("operator/no_orders")
     await operator.start_shift()
-    if len(orders) == 1:
-        await state.update_data(order_id=str(orders[0].id))
+    if len(orders.items) == 1 and orders.next_anchor is None:
+        await ctx.update_data(order_id=str(orders.items[0].id))
         await handle_chosen_order(
-            callback, state, prefix_text=loc.get_text("operator/chosen_order")
+            callback, state, ctx, prefix_text=loc.get_text("operator/chosen_order")
         )
         return
 
@@ -138,6 +252,7 @@ async def handle_start_shift_btn(callback: CallbackQuery, state: FSMContext) ->
 async def handle_chosen_order(
     callback: CallbackQuery,
     state: FSMContext,
+    ctx: UpdateContext,
     callback_data: callbacks.Order | None = None,
     prefix_text: str = "",
 ) -> None:
@@ -145,15 +260,19 @@ async def handle_chosen_order(
     if (message := await helpers.hide_markup_or_delete(callback)) is None:
         return
 
+    storage_data = await ctx.get_data()
     if callback_data is not None:
         order_id = callback_data.id
-        await state.update_data(order_id=str(order_id), bundle_id=None)
+        await ctx.update_data(order_id=str(order_id), bundle_id=None)
     else:
-        storage_data = await state.get_data()
         order_id = storage_data.get("order_id")
-        await state.update_data(bundle_id=None)
+        await ctx.update_data(bundle_id=None)
 
-    if (order := await Order.get(order_id)) is None:
+    if order_id is None or (
+        order := await get_plan_node(
+            storage_data.get("plan_id"), lambda tree: tree.order(order_id)
+        )
+    ) is None:
         await callback.answer(loc.get_text("operator/order_not_found"))
         return
 
@@ -166,18 +285,20 @@ async def handle_chosen_order(
         order.execution_time,
         order.instructions,
     )
-    bundles = await order.get_active_bundles()
-    if not bundles:
-        order.finished = True
-        await order.save()
+    bundles = await get_item_page(PageKind.BUNDLE, str(order.id))
+    if not bundles.items:
+        await Order.find_one(Order.id == order.id).update(
+            Set({Order.finished: True}), CurrentDate({Order.updated_at: True})
+        )
+        invalidate_item_pages(PageKind.ORDER, order.plan_id)
         await message.answer(loc.get_text("operator/order_done", order.name))
-        await handle_start_shift_btn(callback, state)
+        await handle_start_shift_btn(callback, state, ctx)
         return
     await state.set_state(AccountStates.choose_bundle)
-    if len(bundles) == 1:
-        await state.update_data(bundle_id=str(bundles[0].id))
+    if len(bundles.items) == 1 and bundles.next_anchor is None:
+        await ctx.update_data(bundle_id=str(bundles.items[0].id))
         await handle_chosen_bundle(
-            callback, state, prefix_text=order_info + loc.get_text("operator/chosen_bundle")
+            callback, state, ctx, prefix_text=order_info + loc.get_text("operator/chosen_bundle")
         )
         return
 
@@ -191,6 +312,7 @@ async def handle_chosen_order(
 async def handle_chosen_bundle(
     callback: CallbackQuery,
     state: FSMContext,
+    ctx: UpdateContext,
     callback_data: callbacks.Bundle | None = None,
     prefix_text: str = "",
 ) -> None:
@@ -198,15 +320,19 @@ async def handle_chosen_bundle(
     if (message := await helpers.hide_markup_or_delete(callback)) is None:
         return
 
+    storage_data = await ctx.get_data()
     if callback_data is not None:
         bundle_id = callback_data.id
-        await state.update_data(bundle_id=str(bundle_id), product_id=None)
+        await ctx.update_data(bundle_id=str(bundle_id), product_id=None)
     else:
-        storage_data = await state.get_data()
         bundle_id = storage_data.get("bundle_id")
-        await state.update_data(product_id=None)
+        await ctx.update_data(product_id=None)
 
-    if (bundle := await Bundle.get(bundle_id)) is None:
+    if bundle_id is None or (
+        bundle := await get_plan_node(
+            storage_data.get("plan_id"), lambda tree: tree.bundle(bundle_id)
+        )
+    ) is None:
         await callback.answer(loc.get_text("operator/bundle_not_found"))
         return
 
@@ -218,23 +344,25 @@ async def handle_chosen_bundle(
         bundle.execution_time,
         bundle.instructions,
     )
-    products = await bundle.get_active_products()
-    if not products:
-        bundle.finished = True
-        await bundle.save()
+    products = await get_item_page(PageKind.PRODUCT, str(bundle.id))
+    if not products.items:
+        await Bundle.find_one(Bundle.id == bundle.id).update(
+            Set({Bundle.finished: True}), CurrentDate({Bundle.updated_at: True})
+        )
+        invalidate_item_pages(PageKind.BUNDLE, bundle.order_id)
         await message.answer(loc.get_text("operator/bundle_done", bundle.native_id))
         await handle_chosen_order(
-            callback, state, prefix_text=loc.get_text("operator/continue_order")
+            callback, state, ctx, prefix_text=loc.get_text("operator/continue_order")
         )
         return
     await state.set_state(AccountStates.choose_product)
-    if len(products) == 1:
-        await state.update_data(product_id=str(products[0].id))
+    if len(products.items) == 1 and products.next_anchor is None:
+        await ctx.update_data(product_id=str(products.items[0].id))
         # await handle_chosen_product(
         #     callback, state, prefix_text=bundle_info + loc.get_text("operator/chosen_product")
         # )
         await message.answer(bundle_info + loc.get_text("operator/chosen_product"))
-        await handle_chosen_product(callback, state)
+        await handle_chosen_product(callback, state, ctx)
         return
 
     await message.answer(
@@ -243,10 +371,42 @@ async def handle_chosen_bundle(
     )
 
 
+@router.callback_query(
+    callbacks.ItemPage.filter(),
+    StateFilter(
+        AccountStates.choose_order,
+        AccountStates.choose_bundle,
+        AccountStates.choose_product,
+    ),
+)
+async def handle_item_page(
+    callback: CallbackQuery,
+    ctx: UpdateContext,
+    callback_data: callbacks.ItemPage,
+) -> None:
+    logger.debug("handle_item_page")
+    parent_id = (await ctx.get_data()).get(PAGE_PARENTS[callback_data.kind])
+    if callback.message is None or parent_id is None:
+        await callback.answer()
+        return
+    page = await get_item_page(
+        callback_data.kind, parent_id, callback_data.anchor, callback_data.forward
+    )
+    kbc = KeyboardCollection()
+    keyboards = {
+        PageKind.ORDER: kbc.choose_order_keyboard,
+        PageKind.BUNDLE: kbc.choose_bundle_keyboard,
+        PageKind.PRODUCT: kbc.choose_product_keyboard,
+    }
+    await callback.message.edit_reply_markup(reply_markup=keyboards[callback_data.kind](page))
+    await callback.answer()
+
+
 @router.callback_query(callbacks.Product.filter(), AccountStates.choose_product)
 async def handle_chosen_product(
     callback: CallbackQuery,
     state: FSMContext,
+    ctx: UpdateContext,
     callback_data: callbacks.Product | None = None,
     prefix_text: str = "",
 ) -> None:
@@ -254,14 +414,14 @@ async def handle_chosen_product(
     if (message := await helpers.hide_markup_or_delete(callback)) is None:
         return
 
+    storage_data = await ctx.get_data()
     if callback_data is not None:
         product_id = callback_data.id
-        await state.update_data(product_id=str(product_id))
+        await ctx.update_data(product_id=str(product_id))
     else:
-        storage_data = await state.get_data()
         product_id = storage_data.get("product_id")
 
-    if (product := await Product.get(product_id)) is None:
+    if (product := await ctx.get(Product, product_id)) is None:
         await callback.answer(loc.get_text("operator/product_not_found"))
         return
 
@@ -281,7 +441,7 @@ async def handle_chosen_product(
     if product.quantity == 0:
         await message.answer(loc.get_text("operator/product_done", product.native_id))
         await handle_chosen_bundle(
-            callback, state, prefix_text=loc.get_text("operator/continue_bundle")
+            callback, state, ctx, prefix_text=loc.get_text("operator/continue_bundle")
         )
         return
 
@@ -290,23 +450,21 @@ async def handle_chosen_product(
         product_info + loc.get_text("operator/enter_result"),
         reply_markup=KeyboardCollection().results_keyboard(products_left=product.quantity),
     )
-    await state.update_data(product_message_id=product_msg.message_id)
+    await ctx.update_data(product_message_id=product_msg.message_id)
 
 
 @router.callback_query(callbacks.FinishProducts.filter(), AccountStates.enter_result)
 async def handle_finish_products(
-    callback: CallbackQuery, state: FSMContext, callback_data: callbacks.FinishProducts
+    callback: CallbackQuery,
+    state: FSMContext,
+    ctx: UpdateContext,
+    callback_data: callbacks.FinishProducts,
 ) -> None:
     logger.debug("handle_finish_products")
-    storage_data = await state.get_data()
+    storage_data = await ctx.get_data()
     if (product_id := storage_data.get("product_id")) is None:
         return
-    if (product := await Product.get(product_id)) is None:
-        await callback.answer(loc.get_text("operator/product_not_found"))
-        return
-    if (operator_id := storage_data.get("operator_id")) is None:
-        return
-    if (operator := await Operator.get(operator_id)) is None:
+    if (operator := await ctx.operator()) is None:
         return
     if (product_message_id := storage_data.get("product_message_id")) is None:
         return
@@ -314,22 +472,25 @@ async def handle_finish_products(
         return
 
     quantity = callback_data.quantity
-    if product.quantity < quantity:
+    if (product := await Product.consume(product_id, quantity)) is None:
+        if (product := await Product.get(product_id)) is None:
+            await callback.answer(loc.get_text("operator/product_not_found"))
+            return
         await callback.answer(
             loc.get_text("operator/wrong_product_count", product.quantity), show_alert=True
         )
         return
+    ctx.remember(product)
+    invalidate_item_pages(PageKind.PRODUCT, product.bundle_id)
 
     await state.set_state(AccountStates.enter_result)
-    product.quantity -= quantity
-    await product.save()
 
     await operator.log_progress(product, count=quantity)
 
     if product.quantity == 0:
         await message.answer(loc.get_text("operator/product_done", product.native_id))
         await handle_chosen_bundle(
-            callback, state, prefix_text=loc.get_text("operator/continue_bundle")
+            callback, state, ctx, prefix_text=loc.get_text("operator/continue_bundle")
         )
         return
 
@@ -356,7 +517,9 @@ async def handle_finish_products(
 
 
 @router.callback_query(F.data == "input_count", AccountStates.enter_result)
-async def handle_input_count_btn(callback: CallbackQuery, state: FSMContext) -> None:
+async def handle_input_count_btn(
+    callback: CallbackQuery, state: FSMContext, ctx: UpdateContext
+) -> None:
     logger.debug("handle_input_count_btn")
     if (message := await helpers.hide_markup_or_delete(callback)) is None:
         return
@@ -365,21 +528,16 @@ async def handle_input_count_btn(callback: CallbackQuery, state: FSMContext) ->
 
 
 @router.message(F.text, AccountStates.input_count)
-async def handle_count_input(message: Message, state: FSMContext) -> None:
+async def handle_count_input(
+    message: Message, state: FSMContext, ctx: UpdateContext
+) -> None:
     logger.debug("handle_count_input")
-    storage_data = await state.get_data()
+    storage_data = await ctx.get_data()
     if (product_id := storage_data.get("product_id")) is None:
         return
-    if (operator_id := storage_data.get("operator_id")) is None:
-        return
 
     kbc = KeyboardCollection()
-    if (product := await Product.get(product_id)) is None:
-        await message.answer(
-            loc.get_text("operator/product_not_found"), reply_markup=kbc.return_keyboard(),
-        )
-        return
-    if (operator := await Operator.get(operator_id)) is None:
+    if (operator := await ctx.operator()) is None:
         return
 
     if helpers.is_int(message.text):
@@ -390,15 +548,19 @@ async def handle_count_input(message: Message, state: FSMContext) -> None:
         await message.answer(loc.get_text("operator/results/number_required"))
         return
 
-    if product.quantity < count:
+    if (product := await Product.consume(product_id, count)) is None:
+        if (product := await Product.get(product_id)) is None:
+            await message.answer(
+                loc.get_text("operator/product_not_found"), reply_markup=kbc.return_keyboard(),
+            )
+            return
         await message.answer(
             loc.get_text("operator/wrong_product_count", product.quantity),
             reply_markup=kbc.return_keyboard(),
         )
         return
-
-    product.quantity -= count
-    await product.save()
+    ctx.remember(product)
+    invalidate_item_pages(PageKind.PRODUCT, product.bundle_id)
 
     await operator.log_progress(product, count)
 
@@ -409,58 +571,59 @@ async def handle_count_input(message: Message, state: FSMContext) -> None:
 
 
 @router.callback_query(F.data == "finish_product", AccountStates.enter_result)
-async def handle_finish_product_btn(callback: CallbackQuery, state: FSMContext) -> None:
+async def handle_finish_product_btn(
+    callback: CallbackQuery, state: FSMContext, ctx: UpdateContext
+) -> None:
     logger.debug("handle_finish_product_btn")
     if (message := helpers.resolve_message(callback)) is None:
         return
-    storage_data = await state.get_data()
+    storage_data = await ctx.get_data()
     if (product_id := storage_data.get("product_id")) is None:
         return
-    if (product := await Product.get(product_id)) is None:
-        return
-    if (operator_id := storage_data.get("operator_id")) is None:
-        return
-    if (operator := await Operator.get(operator_id)) is None:
+    if (operator := await ctx.operator()) is None:
         return
 
-    product.quantity = 0
-    await product.save()
+    if (consumed := await Product.consume_all(product_id)) is None:
+        return
+    product, count = consumed
+    ctx.remember(product)
+    invalidate_item_pages(PageKind.PRODUCT, product.bundle_id)
 
-    await operator.log_progress(product, product.quantity)
+    await operator.log_progress(product, count)
 
     await message.answer(loc.get_text("operator/product_done", product.native_id))
     await handle_chosen_bundle(
-        callback, state, prefix_text=loc.get_text("operator/continue_bundle")
+        callback, state, ctx, prefix_text=loc.get_text("operator/continue_bundle")
     )
 
 
 @router.callback_query(F.data == "finish_bundle", AccountStates.choose_product)
-async def handle_finish_bundle_btn(callback: CallbackQuery, state: FSMContext) -> None:
+async def handle_finish_bundle_btn(
+    callback: CallbackQuery, state: FSMContext, ctx: UpdateContext
+) -> None:
     logger.debug("handle_finish_bundle_btn")
     if (message := helpers.resolve_message(callback)) is None:
         return
-    storage_data = await state.get_data()
-    if (bundle_id := storage_data.get("bundle_id")) is None:
-        return
-    if (bundle := await Bundle.get(bundle_id)) is None:
+    if (bundle := await ctx.bundle()) is None:
         return
-    if (operator_id := storage_data.get("operator_id")) is None:
-        return
-    if (operator := await Operator.get(operator_id)) is None:
+    if (operator := await ctx.operator()) is None:
         return
 
-    for product_id in bundle.products:
-        if (product := await Product.get(product_id)) is None:
-            continue
-        await operator.log_progress(product, product.quantity)
-        product.quantity = 0
-        await product.save()
+    consumed = await Product.consume_many(bundle.products)
+    await Bundle.find_one(Bundle.id == bundle.id).update(
+        Set({Bundle.finished: True}), CurrentDate({Bundle.updated_at: True})
+    )
+    invalidate_item_pages(PageKind.PRODUCT, bundle.id)
+    invalidate_item_pages(PageKind.BUNDLE, bundle.order_id)
 
-    bundle.finished = True
-    await bundle.save()
+    for product, _ in consumed:
+        ctx.remember(product)
+    await operator.log_progress_many(consumed)
 
     await message.answer(loc.get_text("operator/bundle_done", bundle.native_id))
-    await handle_chosen_order(callback, state, prefix_text=loc.get_text("operator/continue_order"))
+    await handle_chosen_order(
+        callback, state, ctx, prefix_text=loc.get_text("operator/continue_order")
+    )
 
 
 @router.callback_query(
@@ -472,21 +635,20 @@ async def handle_finish_bundle_btn(callback: CallbackQuery, state: FSMContext) -
         AccountStates.enter_result,
     ),
 )
-async def handle_finish_shift(callback: CallbackQuery, state: FSMContext) -> None:
+async def handle_finish_shift(
+    callback: CallbackQuery, state: FSMContext, ctx: UpdateContext
+) -> None:
     logger.debug("handle_finish_shift")
     if (message := await helpers.hide_markup_or_delete(callback)) is None:
         return
 
-    storage_data = await state.get_data()
-    if (operator_id := storage_data.get("operator_id")) is None:
-        return
-    if (operator := await Operator.get(operator_id)) is None:
+    storage_data = await ctx.get_data()
+    if (operator := await ctx.operator()) is None:
         return
-    if (line_id := storage_data.get("line_id")) is None:
+    if (line := await ctx.line()) is None:
         return
-    if (line := await ProductionLine.get(line_id)) is None:
-        return
-    if (plan := await Plan.get_current()) is None:
+    plan_id = storage_data.get("plan_id")
+    if (plan := await (Plan.get(plan_id) if plan_id else Plan.get_current())) is None:
         return
 
     await state.set_state(AccountStates.input_count)
@@ -499,12 +661,12 @@ async def handle_finish_shift(callback: CallbackQuery, state: FSMContext) -> Non
     produced_rounded = round(produced_ton, 4)
     income_rounded = round(income, 2)
 
-    line_idle_duration = round(line.get_idle_duration_today() / 60, 1)
+    line_idle_duration = round(await line.get_idle_duration_today() / 60, 1)
 
     await message.answer(
         loc.get_text("operator/finish_shift", produced_rounded, income_rounded, line_idle_duration)
     )
-    await handle_chosen_line(callback, state)
+    await handle_chosen_line(callback, state, ctx)
 
 
 @router.callback_query(
@@ -516,13 +678,15 @@ async def handle_finish_shift(callback: CallbackQuery, state: FSMContext) -> Non
         AccountStates.enter_result,
     ),
 )
-async def handle_idle_btn(callback: CallbackQuery, state: FSMContext) -> None:
+async def handle_idle_btn(
+    callback: CallbackQuery, state: FSMContext, ctx: UpdateContext
+) -> None:
     logger.debug("handle_idle_btn")
     if (message := await helpers.hide_markup_or_delete(callback)) is None:
         return
 
     current_state = await state.get_state()
-    await state.update_data(state_before_idle=current_state)
+    await ctx.update_data(state_before_idle=current_state)
 
     await state.set_state(AccountStates.idle)
     await message.answer(
@@ -534,7 +698,10 @@ async def handle_idle_btn(callback: CallbackQuery, state: FSMContext) -> None:
 # @router.callback_query(F.data.in_({IdleType.SCHEDULED, IdleType.UNSCHEDULED}), AccountStates.idle)
 @router.callback_query(callbacks.Idle.filter(), AccountStates.idle)
 async def handle_idle_type(
-    callback: CallbackQuery, state: FSMContext, callback_data: callbacks.Idle
+    callback: CallbackQuery,
+    state: FSMContext,
+    ctx: UpdateContext,
+    callback_data: callbacks.Idle,
 ) -> None:
     logger.debug("handle_idle_type")
     if (message := await helpers.hide_markup_or_delete(callback)) is None:
@@ -553,20 +720,18 @@ async def handle_idle_type(
 # @router.callback_query(F.data.startswith("idle"), AccountStates.idle_option)
 @router.callback_query(callbacks.IdleOption.filter(), AccountStates.idle_option)
 async def handle_idle_reason(
-    callback: CallbackQuery, state: FSMContext, callback_data: callbacks.IdleOption
+    callback: CallbackQuery,
+    state: FSMContext,
+    ctx: UpdateContext,
+    callback_data: callbacks.IdleOption,
 ) -> None:
     logger.debug("handle_idle_reason")
     if (message := await helpers.hide_markup_or_delete(callback)) is None:
         return
 
-    storage_data = await state.get_data()
-    if (line_id := storage_data.get("line_id")) is None:
+    if (line := await ctx.line()) is None:
         return
-    if (line := await ProductionLine.get(line_id)) is None:
-        return
-    if (operator_id := storage_data.get("operator_id")) is None:
-        return
-    if (operator := await Operator.get(operator_id)) is None:
+    if (operator := await ctx.operator()) is None:
         return
 
     await state.set_state(AccountStates.idle_now)
@@ -580,14 +745,14 @@ async def handle_idle_reason(
 
 
 @router.callback_query(F.data == "finish_idle", AccountStates.idle_now)
-async def handle_finish_idle(callback: CallbackQuery, state: FSMContext) -> None:
+async def handle_finish_idle(
+    callback: CallbackQuery, state: FSMContext, ctx: UpdateContext
+) -> None:
     logger.debug("handle_finish_idle")
     if (message := helpers.resolve_message(callback)) is None:
         return
-    storage_data = await state.get_data()
-    if (line_id := storage_data.get("line_id")) is None:
-        return
-    if (line := await ProductionLine.get(line_id)) is None:
+    storage_data = await ctx.get_data()
+    if (line := await ctx.line()) is None:
         return
 
     await line.finish_idle()
@@ -596,15 +761,15 @@ async def handle_finish_idle(callback: CallbackQuery, state: FSMContext) -> None
     last_state = storage_data.get("state_before_idle")
     match last_state:
         case AccountStates.enter_result.state:
-            await handle_chosen_product(callback, state)
+            await handle_chosen_product(callback, state, ctx)
         case AccountStates.choose_product.state:
-            await handle_chosen_bundle(callback, state)
+            await handle_chosen_bundle(callback, state, ctx)
         case AccountStates.choose_bundle.state:
-            await handle_chosen_order(callback, state)
+            await handle_chosen_order(callback, state, ctx)
         case AccountStates.choose_order.state:
-            await handle_start_shift_btn(callback, state)
+            await handle_start_shift_btn(callback, state, ctx)
         case _:
-            await handle_chosen_line(callback, state)
+            await handle_chosen_line(callback, state, ctx)
 
 
 @router.callback_query(
@@ -620,19 +785,21 @@ async def handle_finish_idle(callback: CallbackQuery, state: FSMContext) -> None
         AccountStates.idle_option,
     ),
 )
-async def handle_return(callback: CallbackQuery, state: FSMContext) -> None:
+async def handle_return(
+    callback: CallbackQuery, state: FSMContext, ctx: UpdateContext
+) -> None:
     logger.debug("handle_return")
     current_state = await state.get_state()
     match current_state:
         case AccountStates.enter_result:
-            await handle_chosen_bundle(callback, state)
+            await handle_chosen_bundle(callback, state, ctx)
         case AccountStates.choose_product:
-            await handle_chosen_order(callback, state)
+            await handle_chosen_order(callback, state, ctx)
         case AccountStates.choose_bundle:
-            await handle_start_shift_btn(callback, state)
+            await handle_start_shift_btn(callback, state, ctx)
         case AccountStates.input_count:
-            await handle_chosen_product(callback, state)
+            await handle_chosen_product(callback, state, ctx)
         case AccountStates.idle | AccountStates.choose_operator | AccountStates.choose_action:
             await choose_line(callback, state)
         case AccountStates.idle_option:
-            await handle_idle_btn(callback, state)
+            await handle_idle_btn(callback, state, ctx)
@@ -1,6 +1,6 @@
 from aiogram import Router, F
 from aiogram.types import Message, ReplyKeyboardRemove
-from aiogram.filters import CommandStart, Command
+from aiogram.filters import CommandObject, CommandStart, Command
 from aiogram.fsm.context import FSMContext
 
 from app import utils
@@ -11,10 +11,10 @@ from app.models import Account
 from app.enums import UserRole
 from app.keyboards import KeyboardCollection
 from app.states import AccountStates
-from loaders import loc
+from loaders import account_cache, loc
 
 
-router = Router()
+router = Router(name="start")
 router.message.filter(F.from_user.id != F.bot.id)
 
 
@@ -24,10 +24,31 @@ async def ping_cmd(message: Message) -> None:
 
 
 @router.message(Command("dump"), UserRoleFilter(UserRole.ADMIN))
-async def dump_cmd(message: Message) -> None:
-    utils.make_db_dump()
-    zip_file = utils.zip_folder("../storage/dump")
-    await utils.send_dump([message.from_user.id], zip_file)
+async def dump_cmd(message: Message, command: CommandObject) -> None:
+    if utils.dump_lock.locked():
+        await message.answer(loc.get_text("start/dump_busy"))
+        return
+    if command.args == "inc":
+        async with utils.dump_lock:
+            result = await utils.send_increment([message.from_user.id])
+        if result is None:
+            await message.answer(loc.get_text("start/dump_failed"))
+        else:
+            await message.answer(loc.get_text("start/dump_increment", result))
+        return
+    async with utils.dump_lock:
+        progress = await message.answer(
+            loc.get_text("start/dump_progress", 0)
+        )
+        dump, delivered = await utils.send_dump(
+            [message.from_user.id], progress
+        )
+    if dump.returncode or not delivered:
+        await progress.edit_text(loc.get_text("start/dump_failed"))
+    else:
+        await progress.edit_text(
+            loc.get_text("start/dump_done", round(dump.size / 1024 / 1024, 1))
+        )
 
 
 @router.message(CommandStart())
@@ -63,8 +84,11 @@ async def handle_contact(message: Message, state: FSMContext) -> None:
         loc.get_text("Аккаунт активирован"), reply_markup=ReplyKeyboardRemove()
     )
 
+    previous_tg_id = user.tg_id
     user.tg_id = message.from_user.id
     await user.save()
+    await account_cache.invalidate(previous_tg_id)
+    await account_cache.invalidate(user.tg_id)
 
     if user.role == UserRole.OPERATOR:
         await operator.choose_line(message, state)
@@ -0,0 +1,526 @@
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import AsyncIterable, AsyncIterator, Iterable, TypeVar
+
+from beanie import BeanieObjectId, Document, PydanticObjectId
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorClientSession
+from pydantic import BaseModel
+from pymongo import DeleteMany, InsertOne, UpdateOne
+
+from app.models import (
+    Bundle,
+    Bundle_,
+    Order,
+    Order_,
+    Plan,
+    Product,
+    Product_,
+    Tombstone,
+    fetch_children,
+)
+
+T = TypeVar("T")
+DocT = TypeVar("DocT", Order, Bundle, Product)
+BulkOperation = DeleteMany | InsertOne | UpdateOne
+OrdersSource = Iterable[Order_ | BeanieObjectId] | AsyncIterable[Order_ | BeanieObjectId]
+
+
+ORDER_FIELDS = (
+    "name",
+    "production_line_id",
+    "total_mass",
+    "total_length",
+    "execution_time",
+    "instructions",
+)
+BUNDLE_FIELDS = ("total_mass", "total_length", "execution_time", "instructions")
+PRODUCT_FIELDS = (
+    "profile",
+    "width",
+    "thickness",
+    "length",
+    "color",
+    "roll_number",
+    "instructions",
+)
+
+
+async def _aiterate(items: Iterable[T] | AsyncIterable[T]) -> AsyncIterator[T]:
+    if isinstance(items, AsyncIterable):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+async def _started(items: OrdersSource) -> AsyncIterator[Order_ | BeanieObjectId]:
+    """
+    Waits for the first order before returning the whole stream, so a
+    failed or not modified (304) request is raised before any query.
+    """
+    iterator = _aiterate(items)
+    try:
+        first = await anext(iterator)
+    except StopAsyncIteration:
+        return _aiterate(())
+
+    async def _chained() -> AsyncIterator[Order_ | BeanieObjectId]:
+        yield first
+        async for item in iterator:
+            yield item
+
+    return _chained()
+
+
+@dataclass
+class IngestStats:
+    plans: int = 0
+    orders: int = 0
+    bundles: int = 0
+    products: int = 0
+    batches: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def documents(self) -> int:
+        return self.plans + self.orders + self.bundles + self.products
+
+    @property
+    def docs_per_second(self) -> float:
+        return self.documents / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def products_per_second(self) -> float:
+        return self.products / self.elapsed if self.elapsed else 0.0
+
+    def merge(self, other: "IngestStats") -> None:
+        self.plans += other.plans
+        self.orders += other.orders
+        self.bundles += other.bundles
+        self.products += other.products
+        self.batches += other.batches
+
+    def __str__(self) -> str:
+        return (
+            f"plans: {self.plans}, orders: {self.orders}, bundles: {self.bundles}, "
+            f"products: {self.products}, batches: {self.batches}, "
+            f"elapsed: {self.elapsed:.2f}s, {self.docs_per_second:.0f} docs/s, "
+            f"{self.products_per_second:.0f} products/s"
+        )
+
+
+@dataclass
+class SyncStats:
+    inserted: Counter[str] = field(default_factory=Counter)
+    updated: Counter[str] = field(default_factory=Counter)
+    deleted: Counter[str] = field(default_factory=Counter)
+    unchanged: Counter[str] = field(default_factory=Counter)
+    elapsed: float = 0.0
+
+    def __str__(self) -> str:
+        def _counts(counter: Counter[str]) -> str:
+            return "/".join(str(counter[name]) for name in ("orders", "bundles", "products"))
+
+        return (
+            f"orders/bundles/products inserted: {_counts(self.inserted)}, "
+            f"updated: {_counts(self.updated)}, deleted: {_counts(self.deleted)}, "
+            f"unchanged: {_counts(self.unchanged)}, elapsed: {self.elapsed:.2f}s"
+        )
+
+
+@dataclass
+class _Batch:
+    orders: list[Order] = field(default_factory=list)
+    bundles: list[Bundle] = field(default_factory=list)
+    products: list[Product] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.orders) + len(self.bundles) + len(self.products)
+
+
+class PlanIngester:
+    def __init__(
+        self,
+        client: AsyncIOMotorClient,
+        batch_size: int = 1000,
+        use_transaction: bool = False,
+    ) -> None:
+        self._client = client
+        self.batch_size = batch_size
+        self.use_transaction = use_transaction
+
+    async def ingest(self, orders: OrdersSource, plan_date: date) -> IngestStats:
+        started = time.perf_counter()
+        stats = IngestStats()
+        plan_id = PydanticObjectId()
+        order_ids: list[BeanieObjectId] = []
+        total_mass = 0.0
+        batch = _Batch()
+
+        async with self._session() as session:
+            async for order in _aiterate(orders):
+                if not isinstance(order, Order_):
+                    continue
+                order_ids.append(self._link_order(order, plan_id, batch))
+                total_mass += order.total_mass
+                if len(batch) >= self.batch_size:
+                    await self._flush(batch, session, stats)
+                    batch = _Batch()
+            await self._flush(batch, session, stats)
+
+            # Plan goes last: the bot never sees a plan with missing children.
+            plan = Plan(id=plan_id, orders=order_ids, total_mass=total_mass, date=plan_date)
+            await plan.insert(session=session)
+            stats.plans += 1
+
+        stats.elapsed = time.perf_counter() - started
+        return stats
+
+    @asynccontextmanager
+    async def _session(self) -> AsyncIterator[AsyncIOMotorClientSession | None]:
+        if not self.use_transaction:
+            yield None
+            return
+        async with await self._client.start_session() as session:
+            async with session.start_transaction():
+                yield session
+
+    async def _flush(
+        self, batch: _Batch, session: AsyncIOMotorClientSession | None, stats: IngestStats
+    ) -> None:
+        documents: tuple[list[Document], ...] = (batch.orders, batch.bundles, batch.products)
+        for docs in documents:
+            if not docs:
+                continue
+            await type(docs[0]).insert_many(docs, session=session, ordered=True)
+            stats.batches += 1
+        stats.orders += len(batch.orders)
+        stats.bundles += len(batch.bundles)
+        stats.products += len(batch.products)
+
+    def _link_order(
+        self, order: Order_, plan_id: BeanieObjectId, batch: _Batch
+    ) -> BeanieObjectId:
+        order_id = PydanticObjectId()
+        bundle_ids = [
+            self._link_bundle(bundle, order_id, batch)
+            for bundle in order.bundles
+            if isinstance(bundle, Bundle_)
+        ]
+        batch.orders.append(
+            Order(
+                id=order_id,
+                plan_id=plan_id,
+                native_id=order.native_id,
+                name=order.name,
+                bundles=bundle_ids,
+                production_line_id=order.production_line_id,
+                total_mass=order.total_mass,
+                total_length=order.total_length,
+                execution_time=order.execution_time,
+                instructions=order.instructions,
+            )
+        )
+        return order_id
+
+    def _link_bundle(
+        self, bundle: Bundle_, order_id: BeanieObjectId, batch: _Batch
+    ) -> BeanieObjectId:
+        bundle_id = PydanticObjectId()
+        product_ids = [
+            self._link_product(product, bundle_id, batch)
+            for product in bundle.products
+            if isinstance(product, Product_)
+        ]
+        batch.bundles.append(
+            Bundle(
+                id=bundle_id,
+                order_id=order_id,
+                native_id=bundle.native_id,
+                products=product_ids,
+                total_mass=bundle.total_mass,
+                total_length=bundle.total_length,
+                execution_time=bundle.execution_time,
+                instructions=bundle.instructions,
+            )
+        )
+        return bundle_id
+
+    def _link_product(
+        self, product: Product_, bundle_id: BeanieObjectId, batch: _Batch
+    ) -> BeanieObjectId:
+        product_id = PydanticObjectId()
+        batch.products.append(
+            Product(
+                id=product_id,
+                bundle_id=bundle_id,
+                native_id=product.native_id,
+                profile=product.profile,
+                width=product.width,
+                thickness=product.thickness,
+                length=product.length,
+                quantity_static=product.quantity,
+                quantity=product.quantity,
+                color=product.color,
+                roll_number=product.roll_number,
+                instructions=product.instructions,
+            )
+        )
+        return product_id
+
+
+class PlanSynchronizer:
+    def __init__(self, ingester: PlanIngester) -> None:
+        self._ingester = ingester
+
+    async def apply(self, orders: OrdersSource, plan_date: date) -> IngestStats | SyncStats:
+        if (plan := await Plan.find_one(Plan.date == plan_date)) is None:
+            return await self._ingester.ingest(orders, plan_date)
+        return await self.sync(plan, orders)
+
+    async def sync(self, plan: Plan, orders: OrdersSource) -> SyncStats:
+        """
+        Nothing is written until the whole plan was read: a request, parse
+        or validation error aborts the sync before stale orders are deleted.
+        """
+        started = time.perf_counter()
+        stats = SyncStats()
+        orders = await _started(orders)
+
+        orders_by_plan = await fetch_children(Order, "plan_id", [plan.id])
+        stored_orders = _by_native_id(orders_by_plan.get(plan.id, []))
+        order_ids = [order.id for order in stored_orders.values()]
+        bundles_by_order = await fetch_children(Bundle, "order_id", order_ids)
+        stored_bundles = {
+            order_id: _by_native_id(bundles) for order_id, bundles in bundles_by_order.items()
+        }
+        bundle_ids = [bundle.id for bundles in bundles_by_order.values() for bundle in bundles]
+        products_by_bundle = await fetch_children(Product, "bundle_id", bundle_ids)
+        stored_products = {
+            bundle_id: _by_native_id(products)
+            for bundle_id, products in products_by_bundle.items()
+        }
+
+        # Tombstones go first: a deletion is never lost to exports.
+        ops: dict[type[Document], list[BulkOperation]] = {
+            Tombstone: [],
+            Order: [],
+            Bundle: [],
+            Product: [],
+        }
+        batch = _Batch()
+        plan_order_ids: list[BeanieObjectId] = []
+        total_mass = 0.0
+        async for order in _aiterate(orders):
+            if not isinstance(order, Order_):
+                continue
+            total_mass += order.total_mass
+            if (stored := stored_orders.pop(order.native_id, None)) is None:
+                plan_order_ids.append(self._ingester._link_order(order, plan.id, batch))
+                continue
+            plan_order_ids.append(stored.id)
+            self._sync_order(
+                order, stored, stored_bundles.pop(stored.id, {}), stored_products, ops, batch, stats
+            )
+
+        for stale_order in stored_orders.values():
+            _add_delete(ops, Order, [stale_order.id], "orders", stats)
+            stale_bundles = list(stored_bundles.pop(stale_order.id, {}).values())
+            self._delete_bundles(stale_bundles, stored_products, ops, stats)
+
+        plan_changes: dict[str, object] = {}
+        if plan_order_ids != plan.orders:
+            plan_changes["orders"] = plan_order_ids
+        if total_mass != plan.total_mass:
+            plan_changes["total_mass"] = total_mass
+
+        inserted = IngestStats()
+        async with self._ingester._session() as session:
+            await self._ingester._flush(batch, session, inserted)
+            for model, model_ops in ops.items():
+                if model_ops:
+                    await model.get_motor_collection().bulk_write(
+                        model_ops, ordered=False, session=session
+                    )
+            if plan_changes:
+                await Plan.get_motor_collection().update_one(
+                    {"_id": plan.id},
+                    {"$set": plan_changes, "$currentDate": {"updated_at": True}},
+                    session=session,
+                )
+
+        stats.inserted.update(
+            orders=inserted.orders, bundles=inserted.bundles, products=inserted.products
+        )
+        stats.elapsed = time.perf_counter() - started
+        return stats
+
+    def _sync_order(
+        self,
+        order: Order_,
+        stored: Order,
+        stored_bundles: dict[str, Bundle],
+        stored_products: dict[BeanieObjectId, dict[str, Product]],
+        ops: dict[type[Document], list[BulkOperation]],
+        batch: _Batch,
+        stats: SyncStats,
+    ) -> None:
+        changes = _changed_fields(order, stored, ORDER_FIELDS)
+        bundle_ids: list[BeanieObjectId] = []
+        reopened = False
+        for bundle in order.bundles:
+            if not isinstance(bundle, Bundle_):
+                continue
+            if (stored_bundle := stored_bundles.pop(bundle.native_id, None)) is None:
+                bundle_ids.append(self._ingester._link_bundle(bundle, stored.id, batch))
+                reopened = True
+                continue
+            bundle_ids.append(stored_bundle.id)
+            products = stored_products.pop(stored_bundle.id, {})
+            if self._sync_bundle(bundle, stored_bundle, products, ops, batch, stats):
+                reopened = True
+        self._delete_bundles(list(stored_bundles.values()), stored_products, ops, stats)
+
+        if bundle_ids != stored.bundles:
+            changes["bundles"] = bundle_ids
+        if reopened and stored.finished:
+            changes["finished"] = False
+        _add_update(ops[Order], stored.id, changes, "orders", stats)
+
+    def _sync_bundle(
+        self,
+        bundle: Bundle_,
+        stored: Bundle,
+        stored_products: dict[str, Product],
+        ops: dict[type[Document], list[BulkOperation]],
+        batch: _Batch,
+        stats: SyncStats,
+    ) -> bool:
+        changes = _changed_fields(bundle, stored, BUNDLE_FIELDS)
+        product_ids: list[BeanieObjectId] = []
+        reopened = False
+        for product in bundle.products:
+            if not isinstance(product, Product_):
+                continue
+            if (stored_product := stored_products.pop(product.native_id, None)) is None:
+                product_ids.append(self._ingester._link_product(product, stored.id, batch))
+                reopened = True
+                continue
+            product_ids.append(stored_product.id)
+            if self._sync_product(product, stored_product, ops, stats):
+                reopened = True
+        if stored_products:
+            stale_ids = [product.id for product in stored_products.values()]
+            _add_delete(ops, Product, stale_ids, "products", stats)
+
+        if product_ids != stored.products:
+            changes["products"] = product_ids
+        if reopened and stored.finished:
+            changes["finished"] = False
+        _add_update(ops[Bundle], stored.id, changes, "bundles", stats)
+        return reopened
+
+    def _sync_product(
+        self,
+        product: Product_,
+        stored: Product,
+        ops: dict[type[Document], list[BulkOperation]],
+        stats: SyncStats,
+    ) -> bool:
+        changes = _changed_fields(product, stored, PRODUCT_FIELDS)
+        if product.quantity == stored.quantity_static:
+            _add_update(ops[Product], stored.id, changes, "products", stats)
+            return False
+        # Keep what operators reported against the new target, including
+        # counts that land between the read above and this write: quantity
+        # moves by the change of target on the server, never below zero.
+        # The quantity_static filter stops a concurrent sync applying it twice.
+        delta = product.quantity - stored.quantity_static
+        ops[Product].append(
+            UpdateOne(
+                {"_id": stored.id, "quantity_static": stored.quantity_static},
+                [
+                    {
+                        "$set": {
+                            **{name: {"$literal": value} for name, value in changes.items()},
+                            "quantity_static": product.quantity,
+                            "quantity": {"$max": [{"$add": ["$quantity", delta]}, 0]},
+                            "updated_at": "$$NOW",
+                        }
+                    }
+                ],
+            )
+        )
+        stats.updated["products"] += 1
+        return delta > 0
+
+    def _delete_bundles(
+        self,
+        bundles: list[Bundle],
+        stored_products: dict[BeanieObjectId, dict[str, Product]],
+        ops: dict[type[Document], list[BulkOperation]],
+        stats: SyncStats,
+    ) -> None:
+        if not bundles:
+            return
+        ids = [bundle.id for bundle in bundles]
+        _add_delete(ops, Bundle, ids, "bundles", stats)
+        product_ids = [
+            product.id for i in ids for product in stored_products.pop(i, {}).values()
+        ]
+        if product_ids:
+            _add_delete(ops, Product, product_ids, "products", stats)
+
+
+def _by_native_id(documents: list[DocT]) -> dict[str, DocT]:
+    return {document.native_id: document for document in documents}
+
+
+def _changed_fields(incoming: BaseModel, stored: Document, fields: tuple[str, ...]) -> dict:
+    return {
+        name: getattr(incoming, name)
+        for name in fields
+        if getattr(incoming, name) != getattr(stored, name)
+    }
+
+
+def _add_delete(
+    ops: dict[type[Document], list[BulkOperation]],
+    model: type[Document],
+    ids: list[BeanieObjectId],
+    name: str,
+    stats: SyncStats,
+) -> None:
+    ops[model].append(DeleteMany({"_id": {"$in": ids}}))
+    collection = model.get_settings().name
+    deleted_at = datetime.utcnow()
+    ops[Tombstone].extend(
+        InsertOne(
+            {"collection": collection, "document_id": i, "deleted_at": deleted_at}
+        )
+        for i in ids
+    )
+    stats.deleted[name] += len(ids)
+
+
+def _add_update(
+    ops: list[BulkOperation],
+    document_id: BeanieObjectId | None,
+    changes: dict,
+    name: str,
+    stats: SyncStats,
+) -> None:
+    if not changes:
+        stats.unchanged[name] += 1
+        return
+    ops.append(
+        UpdateOne(
+            {"_id": document_id},
+            {"$set": changes, "$currentDate": {"updated_at": True}},
+        )
+    )
+    stats.updated[name] += 1
@@ -1,4 +1,5 @@
-from functools import partial
+from functools import partial, wraps
+from typing import Callable, Hashable, TypeVar
 
 from aiogram.types import (
     InlineKeyboardButton,
@@ -7,40 +8,76 @@ from aiogram.types import (
     ReplyKeyboardMarkup,
 )
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
-from aiogram_widgets.types import AdditionalButtonsType, ButtonType
 
 from app import callbacks
-from app.enums import IdleReason, IdleType
-from app.models import Bundle, Operator, Order, Product, ProductionLine
+from app.enums import IdleReason, IdleType, PageKind
+from app.models import Bundle, Operator, Order, Page, Product, ProductionLine
 from loaders import loc
 
+Markup = TypeVar("Markup", InlineKeyboardMarkup, ReplyKeyboardMarkup)
+
+
+class _MarkupCache:
+    """Built markups per method, language and arguments, until locales reload."""
+
+    def __init__(self) -> None:
+        self._markups: dict[Hashable, InlineKeyboardMarkup | ReplyKeyboardMarkup] = {}
+        self._version = -1
+
+    def get(self, key: Hashable, build: Callable[[], Markup]) -> Markup:
+        if self._version != loc.version:
+            self._markups.clear()
+            self._version = loc.version
+        if (markup := self._markups.get(key)) is None:
+            markup = self._markups[key] = build()
+        return markup
+
+
+_markups = _MarkupCache()
+
+
+def static_markup(method: Callable[..., Markup]) -> Callable[..., Markup]:
+    """
+    For keyboards that are the same for every user. The markup is shared
+    between calls, so it must not be modified.
+    """
+
+    @wraps(method)
+    def wrapper(
+        self: "KeyboardCollection", *args: Hashable, **kwargs: Hashable
+    ) -> Markup:
+        key = (method.__name__, self._language, args, tuple(sorted(kwargs.items())))
+        return _markups.get(key, lambda: method(self, *args, **kwargs))
+
+    return wrapper
+
 
 class KeyboardCollection:
     def __init__(self, lang: str = "ru") -> None:
         self._language = lang
 
     def _inline(self, text_key: str, callback_data: str) -> InlineKeyboardButton:
-        button_text = loc.get_text(text_key, self._language)
+        button_text = loc.get_text(text_key, lang=self._language)
         return InlineKeyboardButton(text=button_text, callback_data=callback_data)
 
     def inline_return_button(self) -> InlineKeyboardButton:
         return self._inline(text_key="button/RETURN", callback_data="return")
 
-    def return_button_row(self) -> AdditionalButtonsType:
-        return [[self.inline_return_button()]]
-
+    @static_markup
     def return_keyboard(self) -> InlineKeyboardMarkup:
         builder = InlineKeyboardBuilder()
         builder.add(self.inline_return_button())
         builder.adjust(1)
         return builder.as_markup()
 
+    @static_markup
     def continue_keyboard(self) -> InlineKeyboardMarkup:
         builder = InlineKeyboardBuilder()
         builder.add(self._inline(text_key="button/CONTINUE", callback_data="return"))
         builder.adjust(1)
         return builder.as_markup()
 
+    @static_markup
     def yes_no_keyboard(self, return_button: bool = False) -> InlineKeyboardMarkup:
         builder = InlineKeyboardBuilder()
         builder.add(
@@ -52,16 +89,18 @@ class KeyboardCollection:
         builder.adjust(2, 1)
         return builder.as_markup()
 
+    @static_markup
     def contact_keyboard(self) -> ReplyKeyboardMarkup:
         builder = ReplyKeyboardBuilder()
         builder.row(
             KeyboardButton(
-                text=loc.get_text("button/SEND_CONTACT", self._language),
+                text=loc.get_text("button/SEND_CONTACT", lang=self._language),
                 request_contact=True,
             )
         )
         return builder.as_markup(resize_keyboard=True)
 
+    @static_markup
     def terms_keyboard(self) -> InlineKeyboardMarkup:
         builder = InlineKeyboardBuilder()
         builder.add(
@@ -71,6 +110,7 @@ class KeyboardCollection:
         builder.adjust(2)
         return builder.as_markup()
 
+    @static_markup
     def language_keyboard(self) -> InlineKeyboardMarkup:
         builder = InlineKeyboardBuilder()
         builder.button(text="🇷🇺Русский", callback_data="language ru")
@@ -86,11 +126,37 @@ class KeyboardCollection:
         builder.adjust(1)
         return builder.as_markup()
 
-    def operator_buttons(self, operators: list[Operator]) -> list[ButtonType]:
-        return [InlineKeyboardButton(
-            text=operator.name, callback_data=callbacks.Operator(id=operator.id).pack(),
-        ) for operator in operators if operator.id is not None]
+    def choose_operator_keyboard(
+        self, operators: list[Operator], page: int, pages: int
+    ) -> InlineKeyboardMarkup:
+        builder = InlineKeyboardBuilder()
+        for operator in operators:
+            if operator.id is not None:
+                builder.button(
+                    text=operator.name, callback_data=callbacks.Operator(id=operator.id)
+                )
+        builder.adjust(2)
+        navigation = []
+        if page > 0:
+            navigation.append(
+                InlineKeyboardButton(
+                    text=loc.get_text("button/PREV_PAGE", lang=self._language),
+                    callback_data=callbacks.OperatorPage(page=page - 1).pack(),
+                )
+            )
+        if page + 1 < pages:
+            navigation.append(
+                InlineKeyboardButton(
+                    text=loc.get_text("button/NEXT_PAGE", lang=self._language),
+                    callback_data=callbacks.OperatorPage(page=page + 1).pack(),
+                )
+            )
+        if navigation:
+            builder.row(*navigation)
+        builder.row(self.inline_return_button())
+        return builder.as_markup()
 
+    @static_markup
     def choose_action_keyboard(self) -> InlineKeyboardMarkup:
         builder = InlineKeyboardBuilder()
         builder.add(
@@ -100,52 +166,78 @@ class KeyboardCollection:
         builder.adjust(1)
         return builder.as_markup()
 
-    def choose_order_keyboard(self, orders: list[Order]) -> InlineKeyboardMarkup:
+    def _page_buttons(self, kind: PageKind, page: Page) -> list[InlineKeyboardButton]:
+        buttons = []
+        if page.prev_anchor is not None:
+            buttons.append(
+                InlineKeyboardButton(
+                    text=loc.get_text("button/PREV_PAGE", lang=self._language),
+                    callback_data=callbacks.ItemPage(
+                        kind=kind, anchor=page.prev_anchor, forward=False
+                    ).pack(),
+                )
+            )
+        if page.next_anchor is not None:
+            buttons.append(
+                InlineKeyboardButton(
+                    text=loc.get_text("button/NEXT_PAGE", lang=self._language),
+                    callback_data=callbacks.ItemPage(
+                        kind=kind, anchor=page.next_anchor, forward=True
+                    ).pack(),
+                )
+            )
+        return buttons
+
+    def choose_order_keyboard(self, orders: Page[Order]) -> InlineKeyboardMarkup:
         builder = InlineKeyboardBuilder()
-        for order in orders:
+        for order in orders.items:
             if order.id is not None:
                 builder.button(text=order.name, callback_data=callbacks.Order(id=order.id))
-        builder.add(
-            self._inline(text_key="button/FINISH_SHIFT", callback_data="finish_shift"),
-            self._inline(text_key="button/IDLE", callback_data="idle"),
-        )
         builder.adjust(1)
+        if navigation := self._page_buttons(PageKind.ORDER, orders):
+            builder.row(*navigation)
+        builder.row(self._inline(text_key="button/FINISH_SHIFT", callback_data="finish_shift"))
+        builder.row(self._inline(text_key="button/IDLE", callback_data="idle"))
         return builder.as_markup()
 
-    def choose_bundle_keyboard(self, bundles: list[Bundle]) -> InlineKeyboardMarkup:
+    def choose_bundle_keyboard(self, bundles: Page[Bundle]) -> InlineKeyboardMarkup:
         builder = InlineKeyboardBuilder()
-        for bundle in bundles:
+        for bundle in bundles.items:
             if bundle.id is not None:
                 builder.button(text=bundle.native_id, callback_data=callbacks.Bundle(id=bundle.id))
-        builder.add(
-            self._inline(text_key="button/FINISH_SHIFT", callback_data="finish_shift"),
-            self._inline(text_key="button/IDLE", callback_data="idle"),
-            self.inline_return_button(),
-        )
         builder.adjust(1)
+        if navigation := self._page_buttons(PageKind.BUNDLE, bundles):
+            builder.row(*navigation)
+        builder.row(self._inline(text_key="button/FINISH_SHIFT", callback_data="finish_shift"))
+        builder.row(self._inline(text_key="button/IDLE", callback_data="idle"))
+        builder.row(self.inline_return_button())
         return builder.as_markup()
 
-    def choose_product_keyboard(self, products: list[Product]) -> InlineKeyboardMarkup:
+    def choose_product_keyboard(self, products: Page[Product]) -> InlineKeyboardMarkup:
         builder = InlineKeyboardBuilder()
-        for product in products:
+        for product in products.items:
             if product.id is not None:
                 callback_data = callbacks.Product(id=product.id)
                 builder.button(text=product.native_id, callback_data=callback_data)
-        builder.add(
-            self._inline(text_key="button/FINISH_BUNDLE", callback_data="finish_bundle"),
-            self._inline(text_key="button/FINISH_SHIFT", callback_data="finish_shift"),
-            self._inline(text_key="button/IDLE", callback_data="idle"),
-            self.inline_return_button(),
-        )
         builder.adjust(1)
+        if navigation := self._page_buttons(PageKind.PRODUCT, products):
+            builder.row(*navigation)
+        builder.row(self._inline(text_key="button/FINISH_BUNDLE", callback_data="finish_bundle"))
+        builder.row(self._inline(text_key="button/FINISH_SHIFT", callback_data="finish_shift"))
+        builder.row(self._inline(text_key="button/IDLE", callback_data="idle"))
+        builder.row(self.inline_return_button())
         return builder.as_markup()
 
-    def results_keyboard(self, products_left: int = 10) -> InlineKeyboardMarkup:
+    def results_keyboard(self, products_left: int | float = 10) -> InlineKeyboardMarkup:
+        # Only the "finish N" button depends on what is left, and N tops out at 10.
+        return self._results_keyboard(min(10, int(products_left)))
+
+    @static_markup
+    def _results_keyboard(self, quantity: int) -> InlineKeyboardMarkup:
         builder = InlineKeyboardBuilder()
-        quantity = 10 if products_left > 10 else products_left
         if quantity > 1:
             builder.button(
-                text=loc.get_text("button/FINISH_PRODUCTS", quantity),
+                text=loc.get_text("button/FINISH_PRODUCTS", quantity, lang=self._language),
                 callback_data=callbacks.FinishProducts(quantity=quantity),
             )
         builder.add(
@@ -158,60 +250,65 @@ class KeyboardCollection:
         builder.adjust(1)
         return builder.as_markup()
 
+    @static_markup
     def idle_keyboard(self) -> InlineKeyboardMarkup:
         builder = InlineKeyboardBuilder()
         builder.button(
-            text=loc.get_text("button/SCHEDULED_IDLE"),
+            text=loc.get_text("button/SCHEDULED_IDLE", lang=self._language),
             callback_data=callbacks.Idle(type=IdleType.SCHEDULED),
         )
         builder.button(
-            text=loc.get_text("button/UNSCHEDULED_IDLE"),
+            text=loc.get_text("button/UNSCHEDULED_IDLE", lang=self._language),
             callback_data=callbacks.Idle(type=IdleType.UNSCHEDULED),
         )
         builder.add(self.inline_return_button())
         builder.adjust(1)
         return builder.as_markup()
 
+    @static_markup
     def scheduled_idle_keyboard(self) -> InlineKeyboardMarkup:
         builder = InlineKeyboardBuilder()
         sheduled = partial(callbacks.IdleOption, type=IdleType.SCHEDULED)
         builder.button(
-            text=loc.get_text("button/REPAIR"),
+            text=loc.get_text("button/REPAIR", lang=self._language),
             callback_data=sheduled(reason=IdleReason.REPAIR),
         )
         builder.button(
-            text=loc.get_text("button/NO_ORDERS"),
+            text=loc.get_text("button/NO_ORDERS", lang=self._language),
             callback_data=sheduled(reason=IdleReason.NO_ORDERS),
         )
         builder.button(
-            text=loc.get_text("button/COIL_REPLACE"),
+            text=loc.get_text("button/COIL_REPLACE", lang=self._language),
             callback_data=sheduled(reason=IdleReason.COIL_REPLACE),
         )
         builder.add(self.inline_return_button())
         builder.adjust(1)
         return builder.as_markup()
 
+    @static_markup
     def unscheduled_idle_keyboard(self) -> InlineKeyboardMarkup:
         builder = InlineKeyboardBuilder()
         unsheduled = partial(callbacks.IdleOption, type=IdleType.UNSCHEDULED)
         builder.button(
-            text=loc.get_text("button/BREAKDOWN"),
+            text=loc.get_text("button/BREAKDOWN", lang=self._language),
             callback_data=unsheduled(reason=IdleReason.BREAKDOWN),
         )
         builder.button(
-            text=loc.get_text("button/OTHER_REASON"),
+            text=loc.get_text("button/OTHER_REASON", lang=self._language),
             callback_data=unsheduled(reason=IdleReason.OTHER),
         )
         builder.add(self.inline_return_button())
         builder.adjust(1)
         return builder.as_markup()
 
+    @static_markup
     def finish_idle_keyboard(self) -> InlineKeyboardMarkup:
         builder = InlineKeyboardBuilder()
         builder.add(self._inline(text_key="button/FINISH_IDLE", callback_data="finish_idle"))
         builder.adjust(1)
         return builder.as_markup()
 
+    @static_markup
     def admin_keyboard(self) -> InlineKeyboardMarkup:
         builder = InlineKeyboardBuilder()
         builder.add(self._inline(text_key="button/ADD_OPERATOR", callback_data="add_operator"))
@@ -1 +1,5 @@
 from .album_middleware import AlbumMiddleware
+from .context_middleware import UpdateContext, UpdateContextMiddleware
+from .fsm_buffer_middleware import FSMBufferMiddleware
+from .metrics_middleware import MetricsMiddleware
+from .query_stats_middleware import QueryStatsMiddleware
@@ -0,0 +1,60 @@
+from typing import Any, Awaitable, Callable, TypeVar
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.types import TelegramObject
+from beanie import BeanieObjectId, Document
+
+from app.models import Bundle, Operator, ProductionLine
+
+DocType = TypeVar("DocType", bound=Document)
+
+
+class UpdateContext:
+    def __init__(self, state: FSMContext) -> None:
+        self.state = state
+        self._data: dict[str, Any] | None = None
+        self._documents: dict[tuple[type[Document], str], Document | None] = {}
+
+    async def get_data(self) -> dict[str, Any]:
+        if self._data is None:
+            self._data = await self.state.get_data()
+        return self._data
+
+    async def update_data(self, **kwargs: Any) -> dict[str, Any]:
+        self._data = await self.state.update_data(**kwargs)
+        return self._data
+
+    async def get(
+        self, model: type[DocType], doc_id: BeanieObjectId | str | None
+    ) -> DocType | None:
+        if doc_id is None:
+            return None
+        key = (model, str(doc_id))
+        if key not in self._documents:
+            self._documents[key] = await model.get(doc_id)
+        return self._documents[key]  # type: ignore[return-value]
+
+    def remember(self, document: Document) -> None:
+        self._documents[(type(document), str(document.id))] = document
+
+    async def operator(self) -> Operator | None:
+        return await self.get(Operator, (await self.get_data()).get("operator_id"))
+
+    async def line(self) -> ProductionLine | None:
+        return await self.get(ProductionLine, (await self.get_data()).get("line_id"))
+
+    async def bundle(self) -> Bundle | None:
+        return await self.get(Bundle, (await self.get_data()).get("bundle_id"))
+
+
+class UpdateContextMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        if (state := data.get("state")) is not None:
+            data["ctx"] = UpdateContext(state)
+        return await handler(event, data)
@@ -0,0 +1,24 @@
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.types import TelegramObject
+
+from app.fsm import BufferedStorage
+
+
+class FSMBufferMiddleware(BaseMiddleware):
+    def __init__(self, storage: BufferedStorage) -> None:
+        self.storage = storage
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        async with self.storage.buffer():
+            # FSMContextMiddleware has already read the state, reuse it.
+            if isinstance(state := data.get("state"), FSMContext):
+                self.storage.seed_state(state.key, data.get("raw_state"))
+            return await handler(event, data)
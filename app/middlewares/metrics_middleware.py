@@ -0,0 +1,73 @@
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import CallbackQuery, TelegramObject
+
+from app import callbacks
+from app.extras.prometheus import Registry
+
+CALLBACK_PREFIXES = frozenset(
+    value.__prefix__
+    for value in vars(callbacks).values()
+    if isinstance(value, type)
+    and issubclass(value, CallbackData)
+    and value is not CallbackData
+)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Inner middleware, so it only sees updates a handler was found for
+    and knows which handler and router that was.
+    """
+
+    def __init__(self, registry: Registry) -> None:
+        self.latency = registry.histogram(
+            "bot_handler_duration_seconds",
+            "Time spent in a handler",
+            ("router", "handler"),
+        )
+        self.errors = registry.counter(
+            "bot_handler_errors_total",
+            "Exceptions raised by a handler",
+            ("router", "handler", "error"),
+        )
+        self.callbacks = registry.counter(
+            "bot_callbacks_total",
+            "Handled callback queries by callback data prefix",
+            ("prefix",),
+        )
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        router = data.get("event_router")
+        handler_object = data.get("handler")
+        labels = (
+            getattr(router, "name", "unknown"),
+            (
+                getattr(handler_object.callback, "__name__", "unknown")
+                if handler_object is not None
+                else "unknown"
+            ),
+        )
+        if isinstance(event, CallbackQuery) and event.data:
+            prefix = event.data.split(":", 1)[0]
+            # Unknown prefixes are folded together to bound the series count.
+            self.callbacks.inc(
+                (prefix if prefix in CALLBACK_PREFIXES else "other",)
+            )
+
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            self.errors.inc((*labels, type(e).__name__))
+            raise
+        finally:
+            self.latency.observe(labels, time.perf_counter() - started)
@@ -0,0 +1,21 @@
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from app.extras.mongo_monitor import track_queries
+
+
+class QueryStatsMiddleware(BaseMiddleware):
+    def __init__(self, warn_threshold: int | None = None) -> None:
+        self.warn_threshold = warn_threshold
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        update_id = event.update_id if isinstance(event, Update) else None
+        with track_queries(update_id, self.warn_threshold):
+            return await handler(event, data)
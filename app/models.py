@@ -1,13 +1,116 @@
 from __future__ import annotations
 
-from datetime import date, datetime
-
-from beanie import BeanieObjectId, Document
-from pydantic import BaseModel, Field
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Any, Generic, TypeVar
+
+from beanie import (
+    BeanieObjectId,
+    Document,
+    Granularity,
+    Replace,
+    Save,
+    SaveChanges,
+    TimeSeriesConfig,
+    before_event,
+)
+from beanie.operators import CurrentDate, Eq, GT, GTE, In, Inc, LT, Push, Set
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
+from pymongo import ASCENDING, IndexModel, ReturnDocument, UpdateOne
 
 import config
 from app.enums import IdleReason, IdleType, UserRole
 
+DocType = TypeVar("DocType", bound=Document)
+
+
+@dataclass(frozen=True)
+class Page(Generic[DocType]):
+    """
+    A page of documents in _id order. The anchors are the first and last
+    ids of the page, set only when there is a page before or after it.
+    """
+
+    items: list[DocType]
+    prev_anchor: BeanieObjectId | None = None
+    next_anchor: BeanieObjectId | None = None
+
+
+async def fetch_page(
+    model: type[DocType],
+    conditions: list[Any],
+    anchor: BeanieObjectId | None = None,
+    forward: bool = True,
+    limit: int = 10,
+) -> Page[DocType]:
+    """
+    Keyset pagination on _id: the page after (or before) the anchor is a
+    range scan of limit + 1 documents, however deep the page is. A page
+    emptied by finished items falls back to the first one.
+    """
+    if anchor is None:
+        found = await model.find(*conditions).sort(+model.id).limit(limit + 1).to_list()
+        items = found[:limit]
+        return Page(items, next_anchor=items[-1].id if len(found) > limit else None)
+    if forward:
+        found = (
+            await model.find(*conditions, GT(model.id, anchor))
+            .sort(+model.id)
+            .limit(limit + 1)
+            .to_list()
+        )
+        if not found:
+            return await fetch_page(model, conditions, limit=limit)
+        items = found[:limit]
+        return Page(
+            items,
+            prev_anchor=items[0].id,
+            next_anchor=items[-1].id if len(found) > limit else None,
+        )
+    found = (
+        await model.find(*conditions, LT(model.id, anchor))
+        .sort(-model.id)
+        .limit(limit + 1)
+        .to_list()
+    )
+    if not found:
+        return await fetch_page(model, conditions, limit=limit)
+    items = found[:limit][::-1]
+    return Page(
+        items,
+        prev_anchor=items[0].id if len(found) > limit else None,
+        next_anchor=items[-1].id,
+    )
+
+
+async def fetch_children(
+    model: type[DocType],
+    parent_field: str,
+    parent_ids: list[BeanieObjectId],
+    *conditions: Any,
+) -> dict[BeanieObjectId, list[DocType]]:
+    """
+    The children of many parents in one $in query on their parent reference,
+    grouped by parent in _id order: loading a plan level by level costs one
+    query per level, however many documents each level has.
+    """
+    children: dict[BeanieObjectId, list[DocType]] = {}
+    if not parent_ids:
+        return children
+    found = (
+        await model.find(In(getattr(model, parent_field), parent_ids), *conditions)
+        .sort(+model.id)
+        .to_list()
+    )
+    for child in found:
+        children.setdefault(getattr(child, parent_field), []).append(child)
+    return children
+
+
+# updated_at is kept in UTC and set on every write, incremental exports
+# (app/export.py) use it as their high-water mark.
+UPDATED_AT_INDEX = IndexModel([("updated_at", ASCENDING)])
+
 
 class Plan_(BaseModel):
     orders: list[Order_ | BeanieObjectId] = Field(default=[])
@@ -49,6 +152,11 @@ class Account(Document):
     tg_id: int | None = None
     phone: str
     role: str = UserRole.OPERATOR
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+    @before_event(Replace, Save, SaveChanges)
+    def touch(self) -> None:
+        self.updated_at = datetime.utcnow()
 
     @staticmethod
     async def by_tg_id(tg_id: int) -> Account | None:
@@ -60,14 +168,23 @@ class Account(Document):
 
     class Settings:
         name = "accounts"
+        indexes = [UPDATED_AT_INDEX]
 
 
-class ProgressLog(BaseModel):
+class ProgressEvent(Document):
+    operator_id: BeanieObjectId
     product_id: BeanieObjectId
     count: int | float
     total_mass: float
     date: datetime
 
+    class Settings:
+        name = "progress_events"
+        timeseries = TimeSeriesConfig(
+            time_field="date", meta_field="operator_id", granularity=Granularity.minutes
+        )
+        indexes = [IndexModel([("operator_id", ASCENDING), ("date", ASCENDING)])]
+
 
 class ShiftLog(BaseModel):
     start_time: datetime
@@ -78,55 +195,127 @@ class Operator(Document):
     name: str
     rate: int | float
     line_id: BeanieObjectId
-    progress_log: list[ProgressLog] = []
     shift_log: list[ShiftLog] = []
     shift_mass_produced: float = 0.0
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
     async def get_line(self) -> ProductionLine | None:
         return await ProductionLine.get(self.line_id)
 
+    @staticmethod
+    async def page_by_line(
+        line_id: BeanieObjectId, page: int, per_page: int
+    ) -> list[Operator]:
+        return (
+            await Operator.find(Operator.line_id == line_id)
+            .sort(+Operator.id)
+            .skip(page * per_page)
+            .limit(per_page)
+            .to_list()
+        )
+
+    @staticmethod
+    async def count_by_line(line_id: BeanieObjectId) -> int:
+        return await Operator.find(Operator.line_id == line_id).count()
+
     async def start_shift(self) -> None:
         if self.shift_log and self.shift_log[-1].end_time is None:
             return
+        shift = ShiftLog(start_time=datetime.now())
+        await self._update(
+            Set({Operator.shift_mass_produced: 0.0}),
+            Push({Operator.shift_log: shift.model_dump()}),
+        )
         self.shift_mass_produced = 0.0
-        self.shift_log.append(ShiftLog(start_time=datetime.now()))
-        await self.save()
+        self.shift_log.append(shift)
 
     async def finish_shift(self) -> None:
-        if self.shift_log and self.shift_log[-1].end_time:
+        if not self.shift_log or self.shift_log[-1].end_time:
             return
-        self.shift_log[-1].end_time = datetime.now()
-        await self.save()
+        end_time = datetime.now()
+        last_shift = len(self.shift_log) - 1
+        await self._update(Set({f"shift_log.{last_shift}.end_time": end_time}))
+        self.shift_log[-1].end_time = end_time
 
     async def log_progress(self, product: Product, count: int | float) -> None:
-        mass_produced = count * product.unit_mass
-        self.progress_log.append(
-            ProgressLog(
+        await self.log_progress_many([(product, count)])
+
+    async def log_progress_many(
+        self, progress: list[tuple[Product, int | float]]
+    ) -> None:
+        now = datetime.now()
+        events = [
+            ProgressEvent(
+                operator_id=self.id,
                 product_id=product.id,
                 count=count,
-                total_mass=mass_produced,
-                date=datetime.now(),
+                total_mass=count * product.unit_mass,
+                date=now,
             )
-        )
+            for product, count in progress
+            if count
+        ]
+        if not events:
+            return
+        await ProgressEvent.insert_many(events)
+        mass_produced = sum(event.total_mass for event in events)
+        await self._update(Inc({Operator.shift_mass_produced: mass_produced}))
         self.shift_mass_produced += mass_produced
-        await self.save()
+
+    async def get_progress(
+        self, start: datetime, end: datetime | None = None
+    ) -> list[ProgressEvent]:
+        """Progress events in [start, end), an (operator_id, date) index range."""
+        conditions = [ProgressEvent.operator_id == self.id, GTE(ProgressEvent.date, start)]
+        if end is not None:
+            conditions.append(LT(ProgressEvent.date, end))
+        return await ProgressEvent.find(*conditions).sort(+ProgressEvent.date).to_list()
+
+    async def _update(self, *expressions: Any) -> None:
+        await Operator.find_one(Operator.id == self.id).update(
+            *expressions, CurrentDate({Operator.updated_at: True})
+        )
 
     class Settings:
         name = "operators"
+        indexes = [
+            IndexModel([("line_id", ASCENDING), ("_id", ASCENDING)]),
+            UPDATED_AT_INDEX,
+        ]
 
 
-class IdleLog(BaseModel):
+class Tombstone(Document):
+    """A document deleted by plan sync, so incremental exports carry deletions."""
+
+    collection: str
+    document_id: BeanieObjectId
+    deleted_at: datetime = Field(default_factory=datetime.utcnow)
+
+    class Settings:
+        name = "tombstones"
+        indexes = [IndexModel([("deleted_at", ASCENDING)])]
+
+
+class IdleEvent(Document):
+    line_id: BeanieObjectId
     operator_id: BeanieObjectId
     start_time: datetime
     end_time: datetime | None = None
     type: IdleType
     reason: IdleReason
     duration: float | None = None
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+    class Settings:
+        name = "idle_events"
+        indexes = [
+            IndexModel([("line_id", ASCENDING), ("end_time", ASCENDING)]),
+            UPDATED_AT_INDEX,
+        ]
 
 
 class ProductionLine(Document):
     name: str
-    idle_log: list[IdleLog]
 
     async def start_idle(
         self,
@@ -134,30 +323,35 @@ class ProductionLine(Document):
         type: IdleType,
         reason: IdleReason,
     ) -> None:
-        self.idle_log.append(
-            IdleLog(
-                operator_id=operator_id,
-                start_time=datetime.now(),
-                type=type,
-                reason=reason,
-            )
-        )
-        await self.save()
+        await IdleEvent(
+            line_id=self.id,
+            operator_id=operator_id,
+            start_time=datetime.now(),
+            type=type,
+            reason=reason,
+        ).insert()
 
     async def finish_idle(self) -> None:
-        start_time = self.idle_log[-1].start_time
+        idle = await IdleEvent.find(
+            IdleEvent.line_id == self.id, Eq(IdleEvent.end_time, None)
+        ).sort(-IdleEvent.start_time).first_or_none()
+        if idle is None:
+            return
         end_time = datetime.now()
-        duration = (end_time - start_time).seconds
-        self.idle_log[-1].end_time = end_time
-        self.idle_log[-1].duration = duration
-        await self.save()
-
-    def get_idle_duration_today(self) -> float:
-        total_duration = 0
-        for log in self.idle_log:
-            if log.end_time and log.end_time.date() == datetime.now().date():
-                total_duration += log.duration
-        return total_duration
+        duration = (end_time - idle.start_time).seconds
+        await IdleEvent.find_one(IdleEvent.id == idle.id).update(
+            Set({IdleEvent.end_time: end_time, IdleEvent.duration: duration}),
+            CurrentDate({IdleEvent.updated_at: True}),
+        )
+
+    async def get_idle_duration_today(self) -> float:
+        today = datetime.combine(datetime.now().date(), datetime.min.time())
+        total_duration = await IdleEvent.find(
+            IdleEvent.line_id == self.id,
+            GTE(IdleEvent.end_time, today),
+            LT(IdleEvent.end_time, today + timedelta(days=1)),
+        ).sum(IdleEvent.duration)
+        return total_duration or 0
 
     class Settings:
         name = "production_lines"
@@ -167,21 +361,51 @@ class Plan(Document):
     orders: list[BeanieObjectId]
     total_mass: float
     date: date
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
     @staticmethod
     async def get_current() -> Plan | None:
         return await Plan.find_one(Plan.date == datetime.now().date())
 
-    async def get_active_orders(self) -> list[Order]:
-        orders = []
-        for order_id in self.orders:
-            if order := await Order.get(order_id):
-                if not order.finished:
-                    orders.append(order)
-        return orders
+    async def load_tree(self, products: bool = True) -> PlanTree:
+        """
+        The whole plan -> orders -> bundles -> products hierarchy in one
+        pipeline, children in their parent's order. Without products the
+        tree is only the plan structure, which counts never change.
+        """
+
+        def _lookup(model: type[Document], field: str, *stages: dict) -> dict:
+            return {
+                "$lookup": {
+                    "from": model.get_settings().name,
+                    "localField": field,
+                    "foreignField": "_id",
+                    "let": {"ids": f"${field}"},
+                    "pipeline": [
+                        {"$addFields": {"_pos": {"$indexOfArray": ["$$ids", "$_id"]}}},
+                        {"$sort": {"_pos": 1}},
+                        *stages,
+                    ],
+                    "as": field,
+                }
+            }
+
+        if products:
+            bundle_stage = _lookup(Product, "products")
+        else:
+            bundle_stage = {"$project": {"products": 0}}
+        pipeline = [
+            {"$match": {"_id": self.id}},
+            _lookup(Order, "orders", _lookup(Bundle, "bundles", bundle_stage)),
+        ]
+        raw = await Plan.aggregate(pipeline).to_list()
+        if not raw:
+            return PlanTree(_id=self.id, total_mass=self.total_mass, date=self.date)
+        return PlanTree.model_validate(raw[0])
 
     class Settings:
         name = "plans"
+        indexes = [UPDATED_AT_INDEX]
 
 
 class Order(Document):
@@ -195,17 +419,24 @@ class Order(Document):
     execution_time: int
     instructions: str
     finished: bool = False
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
-    async def get_active_bundles(self) -> list[Bundle]:
-        bundles = []
-        for bundle_id in self.bundles:
-            if bundle := await Bundle.get(bundle_id):
-                if not bundle.finished:
-                    bundles.append(bundle)
-        return bundles
+    @staticmethod
+    async def page_active(
+        plan_id: BeanieObjectId,
+        anchor: BeanieObjectId | None = None,
+        forward: bool = True,
+        limit: int = 10,
+    ) -> Page[Order]:
+        conditions = [Order.plan_id == plan_id, Eq(Order.finished, False)]
+        return await fetch_page(Order, conditions, anchor, forward, limit)
 
     class Settings:
         name = "orders"
+        indexes = [
+            IndexModel([("plan_id", ASCENDING), ("finished", ASCENDING), ("_id", ASCENDING)]),
+            UPDATED_AT_INDEX,
+        ]
 
 
 class Bundle(Document):
@@ -217,17 +448,24 @@ class Bundle(Document):
     execution_time: int
     instructions: str
     finished: bool = False
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
-    async def get_active_products(self) -> list[Product]:
-        products = []
-        for product_id in self.products:
-            if product := await Product.get(product_id):
-                if product.quantity > 1:
-                    products.append(product)
-        return products
+    @staticmethod
+    async def page_active(
+        order_id: BeanieObjectId,
+        anchor: BeanieObjectId | None = None,
+        forward: bool = True,
+        limit: int = 10,
+    ) -> Page[Bundle]:
+        conditions = [Bundle.order_id == order_id, Eq(Bundle.finished, False)]
+        return await fetch_page(Bundle, conditions, anchor, forward, limit)
 
     class Settings:
         name = "bundles"
+        indexes = [
+            IndexModel([("order_id", ASCENDING), ("finished", ASCENDING), ("_id", ASCENDING)]),
+            UPDATED_AT_INDEX,
+        ]
 
 
 class Product(Document):
@@ -238,10 +476,98 @@ class Product(Document):
     thickness: float
     length: float
     quantity_static: int
-    quantity: int
+    quantity: int | float
     color: str
     roll_number: int
     instructions: str
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+    @staticmethod
+    async def page_active(
+        bundle_id: BeanieObjectId,
+        anchor: BeanieObjectId | None = None,
+        forward: bool = True,
+        limit: int = 10,
+    ) -> Page[Product]:
+        # quantity stays out of the index so the _id range is a plain scan.
+        conditions = [Product.bundle_id == bundle_id, GT(Product.quantity, 0)]
+        return await fetch_page(Product, conditions, anchor, forward, limit)
+
+    @staticmethod
+    async def consume(
+        product_id: BeanieObjectId | str, count: int | float
+    ) -> Product | None:
+        # A negative or NaN count passes the $gte guard and adds quantity.
+        if not count > 0:
+            return None
+        raw = await Product.get_motor_collection().find_one_and_update(
+            {"_id": BeanieObjectId(product_id), "quantity": {"$gte": count}},
+            {"$inc": {"quantity": -count}, "$currentDate": {"updated_at": True}},
+            return_document=ReturnDocument.AFTER,
+        )
+        return None if raw is None else Product.model_validate(raw)
+
+    @staticmethod
+    async def consume_all(
+        product_id: BeanieObjectId | str,
+    ) -> tuple[Product, int | float] | None:
+        raw = await Product.get_motor_collection().find_one_and_update(
+            {"_id": BeanieObjectId(product_id)},
+            {"$set": {"quantity": 0}, "$currentDate": {"updated_at": True}},
+            return_document=ReturnDocument.BEFORE,
+        )
+        if raw is None:
+            return None
+        product = Product.model_validate(raw)
+        consumed = product.quantity
+        product.quantity = 0
+        return product, consumed
+
+    @staticmethod
+    async def consume_many(
+        product_ids: list[BeanieObjectId], attempts: int = 3
+    ) -> list[tuple[Product, int | float]]:
+        """
+        consume_all for a whole bundle in a fixed number of queries. Each
+        write only zeroes the quantity that was read: a product counted in
+        between is read again and retried, after `attempts` rounds the rest
+        goes through consume_all one by one.
+        """
+        collection = Product.get_motor_collection()
+        consumed: list[tuple[Product, int | float]] = []
+        products = await Product.find(
+            In(Product.id, product_ids), GT(Product.quantity, 0)
+        ).to_list()
+        for _ in range(attempts):
+            if not products:
+                return consumed
+            # Dates are stored in milliseconds, the stamp tells our writes
+            # apart from a concurrent consume on the re-read.
+            now = datetime.utcnow()
+            stamp = now.replace(microsecond=now.microsecond // 1000 * 1000)
+            await collection.bulk_write(
+                [
+                    UpdateOne(
+                        {"_id": product.id, "quantity": product.quantity},
+                        {"$set": {"quantity": 0, "updated_at": stamp}},
+                    )
+                    for product in products
+                ],
+                ordered=False,
+            )
+            read = {product.id: product for product in products}
+            products = []
+            for fresh in await Product.find(In(Product.id, list(read))).to_list():
+                if fresh.quantity == 0 and fresh.updated_at == stamp:
+                    product = read[fresh.id]
+                    consumed.append((product, product.quantity))
+                    product.quantity = 0
+                elif fresh.quantity > 0:
+                    products.append(fresh)
+        for product in products:
+            if (result := await Product.consume_all(product.id)) is not None and result[1]:
+                consumed.append(result)
+        return consumed
 
     @property
     def total_mass(self) -> float:
@@ -255,3 +581,87 @@ class Product(Document):
 
     class Settings:
         name = "products"
+        indexes = [
+            IndexModel([("bundle_id", ASCENDING), ("_id", ASCENDING)]),
+            UPDATED_AT_INDEX,
+        ]
+
+
+class ProductNode(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    id: BeanieObjectId = Field(alias="_id")
+    bundle_id: BeanieObjectId
+    native_id: str
+    profile: str
+    width: float
+    thickness: float
+    length: float
+    quantity_static: int
+    quantity: int | float
+    color: str
+    roll_number: int
+    instructions: str
+
+
+class BundleNode(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    id: BeanieObjectId = Field(alias="_id")
+    order_id: BeanieObjectId
+    native_id: str
+    products: tuple[ProductNode, ...] = ()
+    total_mass: float
+    total_length: float
+    execution_time: int
+    instructions: str
+    finished: bool = False
+
+
+class OrderNode(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    id: BeanieObjectId = Field(alias="_id")
+    plan_id: BeanieObjectId
+    native_id: str
+    name: str
+    bundles: tuple[BundleNode, ...] = ()
+    production_line_id: str
+    total_mass: float
+    total_length: float
+    execution_time: int
+    instructions: str
+    finished: bool = False
+
+
+class PlanTree(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    id: BeanieObjectId = Field(alias="_id")
+    orders: tuple[OrderNode, ...] = ()
+    total_mass: float
+    date: date
+
+    _nodes: dict[BeanieObjectId, OrderNode | BundleNode | ProductNode] = PrivateAttr(
+        default_factory=dict
+    )
+
+    def model_post_init(self, __context: Any) -> None:
+        for order in self.orders:
+            self._nodes[order.id] = order
+            for bundle in order.bundles:
+                self._nodes[bundle.id] = bundle
+                for product in bundle.products:
+                    self._nodes[product.id] = product
+
+    def order(self, order_id: BeanieObjectId | str) -> OrderNode | None:
+        node = self._nodes.get(BeanieObjectId(order_id))
+        return node if isinstance(node, OrderNode) else None
+
+    def bundle(self, bundle_id: BeanieObjectId | str) -> BundleNode | None:
+        node = self._nodes.get(BeanieObjectId(bundle_id))
+        return node if isinstance(node, BundleNode) else None
+
+    def product(self, product_id: BeanieObjectId | str) -> ProductNode | None:
+        node = self._nodes.get(BeanieObjectId(product_id))
+        return node if isinstance(node, ProductNode) else None
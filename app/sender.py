@@ -1,54 +1,334 @@
+import asyncio
+import gzip
 import json
 import logging
 import time
+from collections import defaultdict
+from pathlib import Path
 from typing import Any
 
-import requests
+import aiohttp
 
-import config
+from app.extras import TTLCache
+from app.spool import Spool
 
 logger = logging.getLogger(__name__)
 
+Labels = tuple[tuple[str, str], ...]
+Sample = tuple[str, Labels, Any, int]
+QueryKey = tuple[str, int | None, int | None]
 
-def send_data(name: str, values: list[Any], timestamps: list[int] | None = None) -> None:
-    if timestamps is None:
-        if len(values) > 1:
-            logger.error(f"Error sending {len(values)} without timestamps")
+
+class MetricsExporter:
+    """
+    Buffers samples in memory and pushes them to the import endpoint
+    in batches: one gzipped request with a JSON line per series.
+    Samples are dropped, never awaited, when the buffer is full.
+
+    Batches the endpoint could not take go to the spool and are
+    replayed, oldest segment first, once a request succeeds again.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        headers: dict[str, str] | None = None,
+        enabled: bool = True,
+        batch_size: int = 1000,
+        flush_interval: float = 10.0,
+        queue_size: int = 10000,
+        timeout: float = 20.0,
+        spool: Spool | None = None,
+    ) -> None:
+        self.url = url
+        self.headers = headers or {}
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.spool = spool
+        self.dropped = 0
+        self.lost = 0
+        self._queue: asyncio.Queue[Sample] = asyncio.Queue(maxsize=queue_size)
+        self._batch: list[Sample] = []
+        self._session: aiohttp.ClientSession | None = None
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._session = aiohttp.ClientSession(timeout=self.timeout)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
             return
-        else:
-            timestamps = [int(time.time() * 1000)]
-    if len(values) != len(timestamps):
-        logger.error(
-            f"The number of values ({len(values)}) must be equal "
-            f"to the number of timestamps ({len(timestamps)})"
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        # Samples collected or still queued when the loop stopped.
+        batch, self._batch = self._batch, []
+        batch.extend(
+            self._queue.get_nowait() for _ in range(self._queue.qsize())
+        )
+        await self._flush(batch, replay=False)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def send(
+        self,
+        name: str,
+        value: Any,
+        timestamp: int | None = None,
+        labels: dict[str, str] | None = None,
+    ) -> bool:
+        if timestamp is None:
+            timestamp = int(time.time() * 1000)
+        sample = (
+            name,
+            tuple(sorted((labels or {}).items())),
+            value,
+            timestamp,
         )
-        return
+        if not self.enabled:
+            logger.debug("Metric is not sent: %s", sample)
+            return False
+        try:
+            self._queue.put_nowait(sample)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped % self.batch_size == 1:
+                logger.warning(
+                    "Metrics buffer is full, %s samples dropped", self.dropped
+                )
+            return False
+        return True
+
+    def send_data(
+        self,
+        name: str,
+        values: list[Any],
+        timestamps: list[int] | None = None,
+    ) -> None:
+        if timestamps is None:
+            if len(values) > 1:
+                logger.error(f"Error sending {len(values)} without timestamps")
+                return
+            timestamps = [int(time.time() * 1000)]
+        if len(values) != len(timestamps):
+            logger.error(
+                f"The number of values ({len(values)}) must be equal "
+                f"to the number of timestamps ({len(timestamps)})"
+            )
+            return
+        for value, timestamp in zip(values, timestamps):
+            self.send(name, value, timestamp)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                sample = await asyncio.wait_for(
+                    self._queue.get(), self.flush_interval
+                )
+            except asyncio.TimeoutError:
+                # Nothing new to send, retry what the spool holds.
+                if self.spool is not None and self.spool.pending:
+                    await self._replay()
+                continue
+            self._batch.append(sample)
+            deadline = loop.time() + self.flush_interval
+            while len(self._batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    self._batch.append(
+                        await asyncio.wait_for(self._queue.get(), timeout)
+                    )
+                except asyncio.TimeoutError:
+                    break
+            batch, self._batch = self._batch, []
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[Sample], replay: bool = True) -> None:
+        if not batch or self._session is None:
+            return
+        if not await self._post(batch):
+            if self.spool is None:
+                logger.error("%s metric samples are lost", len(batch))
+                self.lost += len(batch)
+                return
+            try:
+                await self.spool.append(batch)
+            except OSError as e:
+                # A full disk must not stop the loop, newer samples may
+                # still be delivered.
+                logger.error(
+                    "Can't spool %s metric samples, lost: %s", len(batch), e
+                )
+                self.lost += len(batch)
+                return
+            logger.info("Spooled %s metric samples", len(batch))
+        elif replay and self.spool is not None and self.spool.pending:
+            await self._replay()
+
+    async def _replay(self) -> None:
+        for segment in self.spool.seal():
+            try:
+                records = await self.spool.read(segment)
+            except OSError as e:
+                logger.error(
+                    "Can't read spooled segment %s, dropped: %s",
+                    segment.name,
+                    e,
+                )
+                await self._remove(segment)
+                continue
+            samples = [
+                (name, tuple(map(tuple, labels)), value, timestamp)
+                for name, labels, value, timestamp in records
+            ]
+            samples.sort(key=lambda sample: sample[3])
+            for i in range(0, len(samples), self.batch_size):
+                # The segment is kept on failure, so its chunks sent
+                # so far will be sent again on the next attempt.
+                if not await self._post(samples[i : i + self.batch_size]):
+                    return
+            await self._remove(segment)
+            logger.info(
+                "Replayed %s spooled samples from %s",
+                len(samples),
+                segment.name,
+            )
 
-    def _payload(name: str, values: list[Any], timestamps: list[int]) -> str:
-        data = {"metric": {"__name__": name}, "values": values, "timestamps": timestamps}
-        return json.dumps(data)
+    async def _remove(self, segment: Path) -> None:
+        try:
+            await self.spool.remove(segment)
+        except OSError as e:
+            logger.error(
+                "Can't remove spooled segment %s: %s", segment.name, e
+            )
 
-    payload = _payload(name, values, timestamps)
-    logger.debug(f"Sending data: {payload}")
-    if config.SEND_METRICS:
-        response = requests.post(
-            url=config.POST_URL, headers=config.POST_HEADERS, data=payload, timeout=20
+    async def _post(self, batch: list[Sample]) -> bool:
+        """Returns False if the batch should be retried later."""
+        series: dict[tuple[str, Labels], tuple[list, list]] = defaultdict(
+            lambda: ([], [])
         )
-        logger.debug(f"Response status code: {response.status_code}, text: {response.text}")
+        for name, labels, value, timestamp in batch:
+            values, timestamps = series[name, labels]
+            values.append(value)
+            timestamps.append(timestamp)
+        payload = "\n".join(
+            json.dumps(
+                {
+                    "metric": {"__name__": name, **dict(labels)},
+                    "values": values,
+                    "timestamps": timestamps,
+                }
+            )
+            for (name, labels), (values, timestamps) in series.items()
+        )
+        try:
+            async with self._session.post(
+                self.url,
+                data=gzip.compress(payload.encode()),
+                headers={**self.headers, "Content-Encoding": "gzip"},
+            ) as response:
+                if response.status >= 400:
+                    logger.error(
+                        "Metrics import failed with %s: %s",
+                        response.status,
+                        await response.text(),
+                    )
+                    # Only server side failures can succeed on retry.
+                    return response.status != 429 and response.status < 500
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Can't send %s metric samples: %s", len(batch), e)
+            return False
+        logger.debug("Sent %s samples in %s series", len(batch), len(series))
+        return True
+
 
+class MetricsQuery:
+    """
+    Reads series back from the export endpoint. Results are cached per
+    (selector, start, end) for ttl seconds, and concurrent calls with
+    the same key share a single request.
+    """
 
-def get_data(metric: str) -> Any:
-    # params = {"match": f'__name__=~"{metric}"'}
-    params = f'match={{__name__=~"{metric}"}}'
-    try:
-        response = requests.get(
-            url=config.GET_URL, params=params, headers=config.GET_HEADERS, timeout=20
+    def __init__(
+        self,
+        url: str,
+        headers: dict[str, str] | None = None,
+        ttl: float = 30.0,
+        maxsize: int = 256,
+        timeout: float = 20.0,
+    ) -> None:
+        self.url = url
+        self.headers = headers or {}
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._cache: TTLCache[QueryKey, list[dict[str, Any]]] = TTLCache(
+            maxsize=maxsize, ttl=ttl
         )
-        obj = json.loads(response.text)
-    except Exception as err:
-        logger.error("Error by getting metric '%s': %s", metric, str(err))
-        logger.debug("Response status code: %s", response.status_code)
-        logger.debug("Response text: %s", response.text)
-        return
-    else:
-        return obj
+        self._inflight: dict[QueryKey, asyncio.Task] = {}
+        self._session: aiohttp.ClientSession | None = None
+
+    async def get_data(
+        self,
+        metric: str,
+        start: int | None = None,
+        end: int | None = None,
+    ) -> list[dict[str, Any]] | None:
+        key = (f'{{__name__=~"{metric}"}}', start, end)
+        if (series := self._cache.get(key)) is not None:
+            return series
+        if (task := self._inflight.get(key)) is None:
+            task = asyncio.create_task(self._fetch(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # A cancelled caller must not cancel the request others wait for.
+        return await asyncio.shield(task)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _fetch(self, key: QueryKey) -> list[dict[str, Any]] | None:
+        selector, start, end = key
+        params = {"match[]": selector}
+        if start is not None:
+            params["start"] = str(start)
+        if end is not None:
+            params["end"] = str(end)
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=self.timeout)
+        try:
+            async with self._session.get(
+                self.url, params=params, headers=self.headers
+            ) as response:
+                text = await response.text()
+                if response.status >= 400:
+                    logger.error(
+                        "Error by getting metric '%s': %s",
+                        selector,
+                        response.status,
+                    )
+                    logger.debug("Response text: %s", text)
+                    return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            logger.error("Error by getting metric '%s': %s", selector, err)
+            return None
+        try:
+            # The export format is one JSON object per series and line.
+            series = [json.loads(line) for line in text.splitlines() if line]
+        except json.JSONDecodeError as err:
+            logger.error("Can't parse metric '%s': %s", selector, err)
+            logger.debug("Response text: %s", text)
+            return None
+        self._cache.set(key, series)
+        return series
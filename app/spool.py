@@ -0,0 +1,136 @@
+import asyncio
+import json
+import logging
+import struct
+import threading
+import zlib
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# Record header: payload length and its CRC32.
+HEADER = struct.Struct(">II")
+SEGMENT_SUFFIX = ".seg"
+
+
+class Spool:
+    """
+    Append-only store of records that could not be delivered yet.
+
+    Records go to numbered segment files. A segment is closed once it
+    grows past segment_size, and the oldest segments are evicted when
+    the spool outgrows max_bytes. Every record carries a CRC32, so a
+    torn write at the end of a segment is detected and skipped on read.
+
+    Segment sizes are tracked in memory, so pending and seal() never
+    touch the disk; file I/O runs in worker threads.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        segment_size: int = 4 * 1024 * 1024,
+        max_bytes: int = 256 * 1024 * 1024,
+    ) -> None:
+        self.path = Path(path)
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.evicted = 0
+        self.path.mkdir(parents=True, exist_ok=True)
+        segments = sorted(self.path.glob(f"*{SEGMENT_SUFFIX}"))
+        self._sizes = {segment: segment.stat().st_size for segment in segments}
+        self._seq = int(segments[-1].stem) + 1 if segments else 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> bool:
+        return bool(self._sizes)
+
+    async def append(self, records: list[Any]) -> None:
+        payload = json.dumps(records, separators=(",", ":")).encode()
+        await asyncio.to_thread(self._append, payload)
+
+    def seal(self) -> list[Path]:
+        """Close the active segment and return every closed one, oldest first."""
+        with self._lock:
+            if self._active() in self._sizes:
+                self._seq += 1
+            return sorted(self._sizes)
+
+    async def read(self, segment: Path) -> list[Any]:
+        return await asyncio.to_thread(self._read, segment)
+
+    async def remove(self, segment: Path) -> None:
+        # Forgotten first, so a segment that can't be unlinked isn't retried.
+        with self._lock:
+            self._sizes.pop(segment, None)
+        await asyncio.to_thread(segment.unlink, True)
+
+    def _append(self, payload: bytes) -> None:
+        with self._lock:
+            active = self._active()
+        try:
+            with active.open("ab") as file:
+                file.write(HEADER.pack(len(payload), zlib.crc32(payload)))
+                file.write(payload)
+        except OSError:
+            # Reading stops at a torn record, so nothing more goes after it:
+            # what was written is kept and the next record opens a segment.
+            with self._lock:
+                try:
+                    self._sizes[active] = active.stat().st_size
+                except OSError:
+                    pass
+                if active == self._active():
+                    self._seq += 1
+            raise
+        with self._lock:
+            size = self._sizes.get(active, 0) + HEADER.size + len(payload)
+            self._sizes[active] = size
+            if size >= self.segment_size and active == self._active():
+                self._seq += 1
+            evicted = self._evict()
+        for segment in evicted:
+            logger.warning("Spool is over its limit, dropped %s", segment.name)
+            try:
+                segment.unlink(missing_ok=True)
+            except OSError as e:
+                # The record above is stored, only the cleanup failed.
+                logger.error("Can't remove %s: %s", segment.name, e)
+
+    def _read(self, segment: Path) -> list[Any]:
+        records: list[Any] = []
+        data = segment.read_bytes()
+        offset = 0
+        while offset + HEADER.size <= len(data):
+            length, crc = HEADER.unpack_from(data, offset)
+            payload = data[
+                offset + HEADER.size : offset + HEADER.size + length
+            ]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                logger.warning(
+                    "Corrupted record in %s at %s, skipping the rest",
+                    segment.name,
+                    offset,
+                )
+                break
+            records.extend(json.loads(payload))
+            offset += HEADER.size + length
+        return records
+
+    def _evict(self) -> list[Path]:
+        """Forgets the oldest segments over max_bytes, the caller unlinks them."""
+        total = sum(self._sizes.values())
+        evicted = []
+        # The active segment is evicted last, only if it alone is too big.
+        for segment in sorted(self._sizes):
+            if total <= self.max_bytes:
+                break
+            total -= self._sizes.pop(segment)
+            evicted.append(segment)
+            self.evicted += 1
+        return evicted
+
+    def _active(self) -> Path:
+        return self.path / f"{self._seq:012d}{SEGMENT_SUFFIX}"
@@ -1,44 +1,145 @@
-import os
-import shutil
-import subprocess
+import asyncio
+import logging
 from datetime import datetime
+from typing import AsyncGenerator
 
-from aiogram.types import FSInputFile, InputMediaDocument
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import FSInputFile, InputFile, Message
+from aiogram.types.input_file import DEFAULT_CHUNK_SIZE
+from pymongo.errors import PyMongoError
 
 import config
-from loaders import bot, mongo_client
+from app.export import ExportResult, IncrementalExport
+from loaders import bot, loc, mongo_client
 
+logger = logging.getLogger(__name__)
 
-def make_db_dump() -> None:
-    dump_dir_path = "../storage/dump"
-    db_name = mongo_client.get_database().name
-    if not os.path.exists(dump_dir_path):
-        os.makedirs(dump_dir_path)
+# One dump at a time, mongodump is heavy on the database.
+dump_lock = asyncio.Lock()
 
-    subprocess.run(
-        [
+
+class MongoDumpFile(InputFile):
+    """
+    Runs `mongodump --archive --gzip` and streams its stdout straight
+    into the upload, so nothing is written to disk.
+    """
+
+    def __init__(
+        self,
+        uri: str,
+        db_name: str,
+        filename: str | None = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ) -> None:
+        super().__init__(
+            filename=filename or f"dump_{datetime.now():%Y-%m-%d_%H-%M}.gz",
+            chunk_size=chunk_size,
+        )
+        self.uri = uri
+        self.db_name = db_name
+        self.size = 0
+        self.returncode: int | None = None
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        process = await asyncio.create_subprocess_exec(
             "mongodump",
-            f"--db={db_name}",
-            f"--out={dump_dir_path}",
-            f"--uri={config.MONGODB_CONN}",
-        ],
-    )
+            f"--uri={self.uri}",
+            f"--db={self.db_name}",
+            "--archive",
+            "--gzip",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stderr = asyncio.create_task(process.stderr.read())
+        self.size = 0
+        try:
+            while chunk := await process.stdout.read(self.chunk_size):
+                self.size += len(chunk)
+                yield chunk
+        finally:
+            if process.returncode is None and not process.stdout.at_eof():
+                process.kill()
+            self.returncode = await process.wait()
+            if self.returncode:
+                logger.error(
+                    "mongodump exited with %s: %s",
+                    self.returncode,
+                    (await stderr).decode(errors="replace"),
+                )
+            else:
+                stderr.cancel()
+
+
+async def report_progress(
+    message: Message, dump: MongoDumpFile, interval: float = 3.0
+) -> None:
+    reported = -1
+    while True:
+        await asyncio.sleep(interval)
+        if (size := dump.size // (1024 * 1024)) == reported:
+            continue
+        reported = size
+        try:
+            await message.edit_text(loc.get_text("start/dump_progress", size))
+        except TelegramAPIError as e:
+            logger.debug("Can't update dump progress: %s", e)
 
 
-def zip_folder(folder_path: str) -> str:
-    db_zip_file_path = f"temp/archive_{datetime.now()}.zip"
-    shutil.make_archive(
-        db_zip_file_path.replace(".zip", ""), "zip", folder_path
+async def send_dump(
+    receiver_ids: list[int], progress: Message | None = None
+) -> tuple[MongoDumpFile, int]:
+    """
+    Uploads a fresh dump to the first receiver and forwards the uploaded
+    file to the rest by its file_id. Returns the dump and how many
+    receivers got it, none if mongodump could not run.
+    """
+    dump = MongoDumpFile(config.MONGODB_CONN, mongo_client.get_database().name)
+    reporter = (
+        asyncio.create_task(report_progress(progress, dump))
+        if progress is not None
+        else None
     )
-    return db_zip_file_path
+    file_id = None
+    delivered = 0
+    try:
+        for tg_id in receiver_ids:
+            try:
+                sent = await bot.send_document(
+                    chat_id=tg_id, document=file_id or dump
+                )
+            except TelegramAPIError as e:
+                logger.error("Can't send dump to %s: %s", tg_id, e)
+                continue
+            except OSError as e:
+                # mongodump is missing or can't be started, nobody gets it.
+                logger.error("Can't run mongodump: %s", e)
+                break
+            if dump.returncode:
+                break
+            file_id = sent.document.file_id
+            delivered += 1
+    finally:
+        if reporter is not None:
+            reporter.cancel()
+    return dump, delivered
 
 
-async def send_dump(receiver_ids: list[int], zip_file: str) -> None:
-    media_group = [
-        InputMediaDocument(type="document", media=FSInputFile(path=zip_file))
-    ]
+async def send_increment(receiver_ids: list[int]) -> ExportResult | None:
+    """Exports the changes since the previous increment and sends them."""
+    try:
+        result = await IncrementalExport(config.EXPORT_PATH).export()
+    except (OSError, PyMongoError) as e:
+        logger.error("Incremental export failed: %s", e)
+        return None
+    document: str | FSInputFile = FSInputFile(result.segment)
     for tg_id in receiver_ids:
         try:
-            await bot.send_media_group(chat_id=tg_id, media=media_group)
-        except Exception as e:
-            print(e)
+            sent = await bot.send_document(chat_id=tg_id, document=document)
+        except TelegramAPIError as e:
+            logger.error(
+                "Can't send %s to %s: %s", result.segment.name, tg_id, e
+            )
+            continue
+        document = sent.document.file_id
+    return result
@@ -16,6 +16,9 @@ BOT_ALIVE = True if BOT_ALIVE == "1" else False
 DEBUG_MODE = cast(str, os.getenv("DEBUG_MODE"))
 DEBUG_MODE = True if DEBUG_MODE == "1" else False
 
+# seconds between checks of data/texts.csv for changes, 0 - no hot reload
+LOCALES_RELOAD_INTERVAL = float(os.getenv("LOCALES_RELOAD_INTERVAL", "5"))
+
 
 # redis config
 REDIS_HOST = cast(str, os.getenv("REDIS_HOST"))
@@ -24,8 +27,58 @@ REDIS_PORT = cast(str, os.getenv("REDIS_PORT"))
 REDIS_PREFIX = cast(str, os.getenv("REDIS_PREFIX"))
 
 
+# fsm storage config
+FSM_SERIALIZER = os.getenv("FSM_SERIALIZER", "json")
+FSM_TTL = int(os.getenv("FSM_TTL", "604800")) or None
+FSM_STATE_TTLS = {
+    name.strip(): int(ttl)
+    for name, ttl in (
+        item.split("=")
+        for item in os.getenv("FSM_STATE_TTLS", "").split(",")
+        if item.strip()
+    )
+}
+FSM_COMPACTION_INTERVAL = float(os.getenv("FSM_COMPACTION_INTERVAL", "3600"))
+
+
+# account role cache config
+ACCOUNT_CACHE_TTL = float(os.getenv("ACCOUNT_CACHE_TTL", "30"))
+ACCOUNT_CACHE_REDIS_TTL = int(os.getenv("ACCOUNT_CACHE_REDIS_TTL", "3600"))
+
+
 # mongo config
 MONGODB_CONN = os.getenv("MONGODB_CONN")
+# DEBUG_MODE warns when an update repeats one query shape more often
+MONGO_N_PLUS_ONE_THRESHOLD = int(os.getenv("MONGO_N_PLUS_ONE_THRESHOLD", "5"))
+# incremental exports (/dump inc, scripts/export_db.py)
+EXPORT_PATH = os.getenv("EXPORT_PATH", "temp/export")
+
+
+# plan source config
+PLAN_URL = os.getenv("PLAN_URL")
+PLAN_TIMEOUT = float(os.getenv("PLAN_TIMEOUT", "60"))
+PLAN_CONNECT_TIMEOUT = float(os.getenv("PLAN_CONNECT_TIMEOUT", "5"))
+PLAN_RETRIES = int(os.getenv("PLAN_RETRIES", "3"))
+PLAN_POOL_SIZE = int(os.getenv("PLAN_POOL_SIZE", "10"))
+
+
+# metrics config
+SEND_METRICS = os.getenv("SEND_METRICS") == "1"
+POST_URL = os.getenv("POST_URL", "http://localhost:8428/api/v1/import")
+GET_URL = os.getenv("GET_URL", "http://localhost:8428/api/v1/export")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+POST_HEADERS = (
+    {"Authorization": f"Bearer {METRICS_TOKEN}"} if METRICS_TOKEN else {}
+)
+GET_HEADERS = POST_HEADERS
+METRICS_BATCH_SIZE = int(os.getenv("METRICS_BATCH_SIZE", "1000"))
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "10"))
+METRICS_QUEUE_SIZE = int(os.getenv("METRICS_QUEUE_SIZE", "10000"))
+METRICS_SPOOL_PATH = os.getenv("METRICS_SPOOL_PATH", "temp/metrics_spool")
+METRICS_SPOOL_MAX_MB = int(os.getenv("METRICS_SPOOL_MAX_MB", "256"))
+METRICS_QUERY_TTL = float(os.getenv("METRICS_QUERY_TTL", "30"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
 
 
 SPECIFIC_GRAVITY = 0.00785
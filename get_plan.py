@@ -1,80 +1,107 @@
 import asyncio
-from datetime import datetime, timedelta
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
 
 from beanie import init_beanie
 
-from api import API
-from app.models import Account, Bundle, Operator, Order, Plan, Product
+import config
+from api import API, PlanClient, PlanNotModified
+from app.ingestion import (
+    IngestStats,
+    OrdersSource,
+    PlanIngester,
+    PlanSynchronizer,
+    SyncStats,
+)
+from app.models import Account, Bundle, Operator, Order, Plan, Product, Tombstone
 from loaders import mongo_client
 
 DAYS = 2
+CONCURRENCY = 4  # plan days loaded at the same time
+BATCH_SIZE = 1000
+USE_TRANSACTION = False
+VALIDATORS_PATH = Path("temp/plan_validators.json")
+
+
+async def load_day(
+    synchronizer: PlanSynchronizer,
+    semaphore: asyncio.Semaphore,
+    plan_date: date,
+    client: PlanClient | None = None,
+) -> IngestStats | SyncStats | None:
+    params = {"date": plan_date.isoformat()}
+    async with semaphore:
+        orders: OrdersSource
+        if client is None:
+            orders = API().iter_orders()
+        else:
+            # Validators outlive the plan (reset_db.py), they only apply to
+            # a day that is still stored.
+            stored = await Plan.find_one(Plan.date == plan_date)
+            orders = client.iter_orders(params, conditional=stored is not None)
+        try:
+            stats = await synchronizer.apply(orders, plan_date)
+        except PlanNotModified:
+            print(f"{plan_date}: plan not modified, skipped")
+            return None
+    if client is not None:
+        # Only a stored plan may turn into 304s on the next runs.
+        client.commit_validators(params)
+    print(f"{plan_date}: {stats}")
+    return stats
+
+
+def print_summary(results: list[IngestStats | SyncStats | None], elapsed: float) -> None:
+    ingested = IngestStats(elapsed=elapsed)
+    for stats in results:
+        if isinstance(stats, IngestStats):
+            ingested.merge(stats)
+    synced = sum(isinstance(stats, SyncStats) for stats in results)
+    skipped = results.count(None)
+    print(f"Ingested {ingested}")
+    print(f"{synced} plans synced, {skipped} not modified")
 
 
 async def main() -> None:
     await init_beanie(
         database=mongo_client.get_database(),
-        document_models=[Account, Operator, Plan, Order, Bundle, Product],
+        document_models=[Account, Operator, Plan, Order, Bundle, Product, Tombstone],
     )
 
-    for day in range(DAYS):
-        api = API()
-        plan = api.get_plan()
-
-        plan_total_mass = 0.0
-        for order in plan.orders:
-            plan_total_mass += order.total_mass
-
-        plan_date = (datetime.now() + timedelta(days=day)).date()
-        new_plan = Plan(orders=[], total_mass=plan_total_mass, date=plan_date)
-        await new_plan.insert()
+    ingester = PlanIngester(
+        mongo_client, batch_size=BATCH_SIZE, use_transaction=USE_TRANSACTION
+    )
+    synchronizer = PlanSynchronizer(ingester)
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    plan_dates = [(datetime.now() + timedelta(days=day)).date() for day in range(DAYS)]
+    started = time.perf_counter()
 
-        for order in plan.orders:
-            new_order = Order(
-                plan_id=new_plan.id,
-                native_id=order.native_id,
-                name=order.name,
-                bundles=[],
-                production_line_id=order.production_line_id,
-                total_mass=order.total_mass,
-                total_length=order.total_length,
-                execution_time=order.execution_time,
-                instructions=order.instructions,
+    if not config.PLAN_URL:
+        results = await asyncio.gather(
+            *(
+                load_day(synchronizer, semaphore, plan_date)
+                for plan_date in plan_dates
             )
-            await new_order.insert()
-            new_plan.orders.append(new_order.id)
+        )
+        print_summary(results, time.perf_counter() - started)
+        return
 
-            for bundle in order.bundles:
-                new_bundle = Bundle(
-                    order_id=new_order.id,
-                    native_id=bundle.native_id,
-                    products=[],
-                    total_mass=bundle.total_mass,
-                    total_length=bundle.total_length,
-                    execution_time=bundle.execution_time,
-                    instructions=bundle.instructions,
-                )
-                await new_bundle.insert()
-                new_order.bundles.append(new_bundle.id)
-
-                for product in bundle.products:
-                    new_product = Product(
-                        bundle_id=new_bundle.id,
-                        native_id=product.native_id,
-                        profile=product.profile,
-                        width=product.width,
-                        thickness=product.thickness,
-                        length=product.length,
-                        quantity_static=product.quantity,
-                        quantity=product.quantity,
-                        color=product.color,
-                        roll_number=product.roll_number,
-                        instructions=product.instructions,
-                    )
-                    await new_product.insert()
-                    new_bundle.products.append(new_product.id)
-                await new_bundle.save()
-            await new_order.save()
-        await new_plan.save()
+    async with PlanClient(
+        config.PLAN_URL,
+        timeout=config.PLAN_TIMEOUT,
+        connect_timeout=config.PLAN_CONNECT_TIMEOUT,
+        retries=config.PLAN_RETRIES,
+        pool_size=config.PLAN_POOL_SIZE,
+        validators_path=VALIDATORS_PATH,
+    ) as client:
+        results = await asyncio.gather(
+            *(
+                load_day(synchronizer, semaphore, plan_date, client)
+                for plan_date in plan_dates
+            )
+        )
+    print_summary(results, time.perf_counter() - started)
 
 
 if __name__ == "__main__":
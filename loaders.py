@@ -6,10 +6,16 @@ from redis.asyncio.client import Redis
 from motor.motor_asyncio import AsyncIOMotorClient
 
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.redis import RedisStorage, DefaultKeyBuilder
+from aiogram.fsm.storage.memory import SimpleEventIsolation
+from aiogram.fsm.storage.redis import DefaultKeyBuilder
 from aiogram.client.session.aiohttp import AiohttpSession
 
-from app.extras import Localizator
+from app.extras import AccountCache, Localizator
+from app.extras.mongo_monitor import CommandMonitor
+from app.extras.prometheus import Registry
+from app.sender import MetricsExporter, MetricsQuery
+from app.spool import Spool
+from app.fsm import BufferedStorage, FSMCompactor, StateTTL, get_serializer
 from api import API
 
 
@@ -19,9 +25,50 @@ redis_client = Redis(
     port=int(config.REDIS_PORT),
 )
 storage_key = DefaultKeyBuilder(prefix=config.REDIS_PREFIX)
-storage = RedisStorage(redis=redis_client, key_builder=storage_key)
-mongo_client = AsyncIOMotorClient(config.MONGODB_CONN)
-dp = Dispatcher(storage=storage)
+fsm_ttl = StateTTL(config.FSM_TTL, config.FSM_STATE_TTLS)
+storage = BufferedStorage(
+    redis=redis_client,
+    key_builder=storage_key,
+    serializer=get_serializer(config.FSM_SERIALIZER),
+    ttl=fsm_ttl,
+)
+fsm_compactor = FSMCompactor(redis_client, config.REDIS_PREFIX, fsm_ttl)
+registry = Registry()
+mongo_monitor = CommandMonitor(registry)
+mongo_client = AsyncIOMotorClient(
+    config.MONGODB_CONN, event_listeners=[mongo_monitor]
+)
+# BufferedStorage writes the whole data dict when the handler returns, so
+# updates of one chat must not overlap. Polling runs a single process, an
+# in-process lock per chat is enough.
+dp = Dispatcher(storage=storage, events_isolation=SimpleEventIsolation())
 aiosession = AiohttpSession()
 bot = Bot(token=config.BOT_TOKEN, parse_mode="HTML", session=aiosession)
 loc = Localizator("data/texts.csv")
+metrics = MetricsExporter(
+    config.POST_URL,
+    headers=config.POST_HEADERS,
+    enabled=config.SEND_METRICS,
+    batch_size=config.METRICS_BATCH_SIZE,
+    flush_interval=config.METRICS_FLUSH_INTERVAL,
+    queue_size=config.METRICS_QUEUE_SIZE,
+    spool=(
+        Spool(
+            config.METRICS_SPOOL_PATH,
+            max_bytes=config.METRICS_SPOOL_MAX_MB * 1024 * 1024,
+        )
+        if config.SEND_METRICS and config.METRICS_SPOOL_PATH
+        else None
+    ),
+)
+metrics_query = MetricsQuery(
+    config.GET_URL,
+    headers=config.GET_HEADERS,
+    ttl=config.METRICS_QUERY_TTL,
+)
+account_cache = AccountCache(
+    redis_client,
+    prefix=config.REDIS_PREFIX,
+    local_ttl=config.ACCOUNT_CACHE_TTL,
+    redis_ttl=config.ACCOUNT_CACHE_REDIS_TTL,
+)
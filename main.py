@@ -5,18 +5,37 @@ import config
 
 from beanie import init_beanie
 
-from app.middlewares import AlbumMiddleware
+from app.extras.prometheus import serve_metrics
+from app.middlewares import (
+    AlbumMiddleware,
+    FSMBufferMiddleware,
+    MetricsMiddleware,
+    QueryStatsMiddleware,
+)
 from app.handlers import bot_sleep, start, operator, admin
 from app.models import (
     Account,
+    IdleEvent,
     Operator,
     ProductionLine,
     Plan,
     Order,
     Bundle,
     Product,
+    ProgressEvent,
+    Tombstone,
+)
+from loaders import (
+    mongo_client,
+    bot,
+    dp,
+    storage,
+    fsm_compactor,
+    loc,
+    metrics,
+    metrics_query,
+    registry,
 )
-from loaders import mongo_client, bot, dp
 
 
 async def run():
@@ -30,6 +49,9 @@ async def run():
             Order,
             Bundle,
             Product,
+            ProgressEvent,
+            IdleEvent,
+            Tombstone,
         ],
     )
 
@@ -55,10 +77,44 @@ async def run():
     else:
         dp.include_routers(bot_sleep.router)
 
+    dp.update.outer_middleware(FSMBufferMiddleware(storage))
+    dp.update.outer_middleware(
+        QueryStatsMiddleware(
+            config.MONGO_N_PLUS_ONE_THRESHOLD if config.DEBUG_MODE else None
+        )
+    )
     dp.message.middleware(AlbumMiddleware())
 
+    # Without a port nothing is measured, handlers run unwrapped.
+    metrics_server = None
+    if config.METRICS_PORT:
+        metrics_middleware = MetricsMiddleware(registry)
+        dp.message.middleware(metrics_middleware)
+        dp.callback_query.middleware(metrics_middleware)
+        metrics_server = await serve_metrics(
+            registry, config.METRICS_HOST, config.METRICS_PORT
+        )
+
+    if config.LOCALES_RELOAD_INTERVAL:
+        locales_watcher = asyncio.create_task(
+            loc.watch(config.LOCALES_RELOAD_INTERVAL)
+        )
+
+    if config.FSM_COMPACTION_INTERVAL:
+        compaction = asyncio.create_task(
+            fsm_compactor.run(config.FSM_COMPACTION_INTERVAL)
+        )
+
+    metrics.start()
+
     await bot.delete_webhook(drop_pending_updates=False)
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await metrics.stop()
+        await metrics_query.close()
+        if metrics_server is not None:
+            await metrics_server.cleanup()
 
 
 if __name__ == "__main__":
@@ -5,6 +5,7 @@ from beanie import init_beanie
 from app.models import (
     Account,
     Bundle,
+    IdleEvent,
     Operator,
     Order,
     Plan,
@@ -25,6 +26,7 @@ async def main() -> None:
             Bundle,
             Product,
             ProductionLine,
+            IdleEvent,
         ],
     )
 
@@ -33,11 +35,7 @@ async def main() -> None:
     await Bundle.delete_all()
     await Product.delete_all()
     # await Operator.delete_all()
-
-    lines = await ProductionLine.all().to_list()
-    for line in lines:
-        line.idle_log = []
-        await line.save()
+    await IdleEvent.delete_all()
 
 
 if __name__ == "__main__":
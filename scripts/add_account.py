@@ -9,16 +9,17 @@ sys.path.insert(1, str(Path(__file__).parent / ".."))
 
 from app.enums import UserRole
 from app.models import Account
-from loaders import mongo_client
+from loaders import account_cache, mongo_client
 
 
 async def create_or_update(phone: str, role: UserRole) -> None:
     account = await Account.find_one(Eq(Account.phone, phone))
     if account is None:
-        await Account(phone=phone, role=role).create()
+        account = await Account(phone=phone, role=role).create()
     else:
         account.role = role
-        account.save()
+        await account.save()
+    await account_cache.invalidate(account.tg_id)
 
 
 async def main(phone: str, role: UserRole) -> None:
@@ -0,0 +1,122 @@
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import bson
+from beanie import PydanticObjectId, init_beanie
+from motor.motor_asyncio import AsyncIOMotorClient
+
+sys.path.insert(1, str(Path(__file__).parent / ".."))
+
+import config
+from app.models import Operator, Product, ProgressEvent, ShiftLog
+
+HISTORY_LENGTHS = (0, 100, 1_000, 10_000)
+ROUNDS = 50
+
+
+def _history(length: int) -> list[ShiftLog]:
+    start = datetime.now() - timedelta(days=length)
+    return [
+        ShiftLog(
+            start_time=start + timedelta(days=i), end_time=start + timedelta(days=i, hours=8)
+        )
+        for i in range(length)
+    ]
+
+
+# Never inserted, log_progress only reads its id and unit mass.
+PRODUCT = Product(
+    id=PydanticObjectId(),
+    bundle_id=PydanticObjectId(),
+    native_id="bench",
+    profile="bench",
+    width=1,
+    thickness=1,
+    length=1,
+    quantity_static=1,
+    quantity=1,
+    color="bench",
+    roll_number=0,
+    instructions="",
+)
+
+
+async def _document_size(operator: Operator) -> int:
+    raw = await Operator.get_motor_collection().find_one({"_id": operator.id})
+    return len(bson.encode(raw))
+
+
+async def full_save_round(operator: Operator) -> None:
+    operator.shift_mass_produced = 0.0
+    operator.shift_log.append(ShiftLog(start_time=datetime.now()))
+    await operator.save()
+    await ProgressEvent(
+        operator_id=operator.id,
+        product_id=PRODUCT.id,
+        count=1,
+        total_mass=PRODUCT.unit_mass,
+        date=datetime.now(),
+    ).insert()
+    operator.shift_mass_produced += PRODUCT.unit_mass
+    await operator.save()
+    operator.shift_log[-1].end_time = datetime.now()
+    await operator.save()
+
+
+async def partial_round(operator: Operator) -> None:
+    await operator.start_shift()
+    await operator.log_progress(PRODUCT, 1)
+    await operator.finish_shift()
+
+
+async def measure(length: int, write_round) -> list[float]:
+    operator = Operator(
+        name=f"bench-{length}", rate=1, line_id=PydanticObjectId(), shift_log=_history(length)
+    )
+    await operator.insert()
+    timings = []
+    try:
+        for _ in range(ROUNDS):
+            started = time.perf_counter()
+            await write_round(operator)
+            timings.append((time.perf_counter() - started) * 1000 / 3)
+        size = await _document_size(operator)
+    finally:
+        await operator.delete()
+    print(
+        f"{write_round.__name__:>16} | history {length:>6} | doc {size / 1024:>8.1f} KiB | "
+        f"median {statistics.median(timings):>7.2f} ms | "
+        f"p95 {statistics.quantiles(timings, n=20)[-1]:>7.2f} ms"
+    )
+    return timings
+
+
+async def main(uri: str) -> None:
+    if uri == config.MONGODB_CONN:
+        raise SystemExit("Refusing to benchmark the bot database, pass a throwaway one")
+    client = AsyncIOMotorClient(uri)
+    await init_beanie(database=client.get_database(), document_models=[Operator, ProgressEvent])
+    for length in HISTORY_LENGTHS:
+        await measure(length, full_save_round)
+        await measure(length, partial_round)
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compare full-document saves with partial updates of an operator"
+    )
+    parser.add_argument(
+        "--uri",
+        required=True,
+        help="throwaway database, e.g. mongodb://localhost:27017/zavod_bench",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(get_args().uri))
@@ -0,0 +1,33 @@
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+from beanie import init_beanie
+
+sys.path.insert(1, str(Path(__file__).parent / ".."))
+
+import config
+from app.export import EXPORTED, IncrementalExport
+from loaders import mongo_client
+
+
+async def main(path: Path) -> None:
+    await init_beanie(
+        database=mongo_client.get_database(),
+        document_models=[model for model, _ in EXPORTED],
+    )
+    result = await IncrementalExport(path).export()
+    print(f"Exported {result}")
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Export documents changed since the previous run"
+    )
+    parser.add_argument("--path", type=Path, default=Path(config.EXPORT_PATH))
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(get_args().path))
@@ -0,0 +1,63 @@
+import asyncio
+import sys
+from pathlib import Path
+
+from beanie import init_beanie
+
+sys.path.insert(1, str(Path(__file__).parent / ".."))
+
+from app.models import IdleEvent, ProductionLine
+from loaders import mongo_client
+
+BATCH_SIZE = 1000
+
+
+async def migrate_line(raw: dict) -> int:
+    line_id = raw["_id"]
+    events = [
+        IdleEvent(
+            line_id=line_id,
+            operator_id=log["operator_id"],
+            start_time=log["start_time"],
+            end_time=log.get("end_time"),
+            type=log["type"],
+            reason=log["reason"],
+            duration=log.get("duration"),
+        )
+        for log in raw.get("idle_log") or []
+    ]
+
+    # A previous run may have inserted the events and died before the $unset.
+    known_starts = {
+        event.start_time
+        for event in await IdleEvent.find(IdleEvent.line_id == line_id).to_list()
+    }
+    events = [event for event in events if event.start_time not in known_starts]
+    for start in range(0, len(events), BATCH_SIZE):
+        await IdleEvent.insert_many(events[start : start + BATCH_SIZE])
+
+    await ProductionLine.get_motor_collection().update_one(
+        {"_id": line_id}, {"$unset": {"idle_log": ""}}
+    )
+    return len(events)
+
+
+async def main() -> None:
+    await init_beanie(
+        database=mongo_client.get_database(), document_models=[ProductionLine, IdleEvent]
+    )
+
+    cursor = ProductionLine.get_motor_collection().find(
+        {"idle_log": {"$exists": True}}, projection={"idle_log": 1}
+    )
+    lines = events = 0
+    async for raw in cursor:
+        moved = await migrate_line(raw)
+        lines += 1
+        events += moved
+        print(f"line {raw['_id']}: {moved} idle events moved")
+    print(f"Done: {lines} lines, {events} idle events")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+import asyncio
+import sys
+from collections import Counter
+from pathlib import Path
+
+from beanie import init_beanie
+from beanie.operators import GTE, LTE
+
+sys.path.insert(1, str(Path(__file__).parent / ".."))
+
+from app.models import Operator, ProgressEvent
+from loaders import mongo_client
+
+BATCH_SIZE = 1000
+
+
+async def migrate_operator(raw: dict) -> int:
+    operator_id = raw["_id"]
+    events = [
+        ProgressEvent(
+            operator_id=operator_id,
+            product_id=log["product_id"],
+            count=log["count"],
+            total_mass=log["total_mass"],
+            date=log["date"],
+        )
+        for log in raw.get("progress_log") or []
+    ]
+
+    # A previous run may have inserted some of the events and died before
+    # the $unset. Counted per (date, product_id), as one log may repeat them.
+    moved: Counter[tuple] = Counter()
+    if events:
+        moved.update(
+            (event.date, event.product_id)
+            for event in await ProgressEvent.find(
+                ProgressEvent.operator_id == operator_id,
+                GTE(ProgressEvent.date, min(event.date for event in events)),
+                LTE(ProgressEvent.date, max(event.date for event in events)),
+            ).to_list()
+        )
+    new_events = []
+    for event in events:
+        key = (event.date, event.product_id)
+        if moved[key]:
+            moved[key] -= 1
+        else:
+            new_events.append(event)
+    for start in range(0, len(new_events), BATCH_SIZE):
+        await ProgressEvent.insert_many(new_events[start : start + BATCH_SIZE])
+
+    await Operator.get_motor_collection().update_one(
+        {"_id": operator_id}, {"$unset": {"progress_log": ""}}
+    )
+    return len(new_events)
+
+
+async def main() -> None:
+    await init_beanie(
+        database=mongo_client.get_database(), document_models=[Operator, ProgressEvent]
+    )
+
+    cursor = Operator.get_motor_collection().find(
+        {"progress_log": {"$exists": True}}, projection={"progress_log": 1}
+    )
+    operators = events = 0
+    async for raw in cursor:
+        moved = await migrate_operator(raw)
+        operators += 1
+        events += moved
+        print(f"operator {raw['_id']}: {moved} events moved")
+    print(f"Done: {operators} operators, {events} events")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,66 @@
+import argparse
+import hashlib
+import random
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+
+from aiohttp import web
+
+FIXTURE = Path(__file__).parent / ".." / "fixtures" / "response.example.json"
+CHUNK_SIZE = 16 * 1024
+
+
+def _validators(path: Path) -> tuple[str, str, float]:
+    stat = path.stat()
+    digest = hashlib.sha1(path.read_bytes()).hexdigest()
+    return f'"{digest}"', formatdate(stat.st_mtime, usegmt=True), stat.st_mtime
+
+
+def _not_modified(request: web.Request, etag: str, mtime: float) -> bool:
+    if (if_none_match := request.headers.get("If-None-Match")) is not None:
+        return etag in {tag.strip() for tag in if_none_match.split(",")} or if_none_match == "*"
+    if (if_modified_since := request.headers.get("If-Modified-Since")) is not None:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+async def handle_plan(request: web.Request) -> web.StreamResponse:
+    config = request.app["config"]
+    if random.random() < config.fail_rate:
+        return web.Response(status=503, text="try again later")
+
+    path: Path = config.fixture
+    etag, last_modified, mtime = _validators(path)
+    headers = {"ETag": etag, "Last-Modified": last_modified}
+    if _not_modified(request, etag, mtime):
+        return web.Response(status=304, headers=headers)
+
+    response = web.StreamResponse(headers={**headers, "Content-Type": "application/json"})
+    await response.prepare(request)
+    with path.open("rb") as json_file:
+        while chunk := json_file.read(CHUNK_SIZE):
+            await response.write(chunk)
+    await response.write_eof()
+    return response
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Local stand-in for the plan source")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--fixture", type=Path, default=FIXTURE)
+    parser.add_argument(
+        "--fail-rate", type=float, default=0.0, help="share of requests answered with 503"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    app = web.Application()
+    app["config"] = args
+    app.router.add_get("/plan", handle_plan)
+    web.run_app(app, host=args.host, port=args.port)
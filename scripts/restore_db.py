@@ -0,0 +1,61 @@
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+from beanie import init_beanie
+
+sys.path.insert(1, str(Path(__file__).parent / ".."))
+
+import config
+from app.export import EXPORTED, list_segments, restore_segment
+from loaders import mongo_client
+
+
+async def restore_base(archive: Path) -> None:
+    process = await asyncio.create_subprocess_exec(
+        "mongorestore",
+        f"--uri={config.MONGODB_CONN}",
+        f"--archive={archive}",
+        "--gzip",
+        "--drop",
+    )
+    if await process.wait():
+        raise SystemExit(f"mongorestore exited with {process.returncode}")
+
+
+async def main(args: argparse.Namespace) -> None:
+    if args.base is not None:
+        await restore_base(args.base)
+        print(f"Base {args.base.name} restored")
+
+    database = mongo_client.get_database()
+    await init_beanie(
+        database=database, document_models=[model for model, _ in EXPORTED]
+    )
+    for segment in list_segments(args.path)[: args.until]:
+        restored = await restore_segment(segment, database)
+        counts = ", ".join(
+            f"{name}: {count}" for name, count in restored.items()
+        )
+        print(f"{segment.name}: {counts or 'no changes'}")
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Restore a base dump and replay export segments on top of it"
+    )
+    parser.add_argument("--path", type=Path, default=Path(config.EXPORT_PATH))
+    parser.add_argument(
+        "--base",
+        type=Path,
+        help="mongodump --archive --gzip file, e.g. from /dump",
+    )
+    parser.add_argument(
+        "--until", type=int, help="replay only the first N segments"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(get_args()))